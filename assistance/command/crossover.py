@@ -1,12 +1,15 @@
 from collections import defaultdict
-from json import load, dump
+from json import dump
 from pathlib import Path
 from random import shuffle
-from shutil import copy, copytree
+from shutil import copytree, ignore_patterns
 
 from assistance.command import Command
 from assistance.command.info import select_student_by_name
 from data.storage import InteractiveDataStorage
+from util.assignment import balanced_assignment, distribute
+from util.console import string_table
+from util.files import copy_function
 
 
 class ImportCommand(Command):
@@ -52,30 +55,125 @@ class ExportCommand(Command):
 
 
 class AssignTutorsCommand(Command):
+    MAX_TUTORS = 32
+    PERSONAL_META_FILES = ("01_my_name.json", "shared_meta.json", "imported_students.json", "exported_students.json", "included_students.json")
+
     def __init__(self, printer, storage: InteractiveDataStorage):
-        super().__init__(printer, "assign-tutors", ("<-^->",), 1, 1)
+        super().__init__(printer, "assign-tutors", ("<-^->",), 1, 1 + AssignTutorsCommand.MAX_TUTORS, help="""Splits the groups of the only tutorial between several tutors.
+The groups of the reference sheet are balanced by their number of students and the size of their submission.
+Aliases:
+  ■ <-^->
+Arguments:
+  ■ number of the reference sheet
+  ■ optional: tutors as name:capacity, the capacity is the number of groups or a relative share.
+    Without tutors, the names and numbers of groups are asked for.
+Example usage:
+  <-^-> 03
+  <-^-> 03 "Christopher Schuster:2" Alice:1
+""")
         self._storage = storage
 
-    def __call__(self, reference_sheet_name):
+    def __call__(self, reference_sheet_name, *tutor_capacities):
         # Check that only one tutorial exists
         assert len(self._storage.tutorials) == 1, "Only one tutorial supported, assignment was probably done in Müsli."
 
-        # Group people by their last hand in group
+        # Group people by their last hand in group, the size of the hand in estimates the correction effort
+        index = self._storage.get_submission_index(reference_sheet_name)
         groups = []
-        preprocessed_folder = Path(self._storage.get_preprocessed_folder(reference_sheet_name))
-        for hand_in in preprocessed_folder.iterdir():
-            if hand_in.is_dir():
-                with open(hand_in / "submission_meta.json", "r") as file:
-                    data = load(file)
-                group = []
-                for muesli_id in data["muesli_student_ids"]:
-                    group.append(self._storage.get_student_by_muesli_id(muesli_id))
-                groups.append(group)
+        for hand_in in index.names:
+            group = []
+            for muesli_id in index.meta(hand_in)["muesli_student_ids"]:
+                group.append(self._storage.get_student_by_muesli_id(muesli_id))
+            groups.append((group, index.size(hand_in)))
 
         self.printer.inform(f"Found {len(groups)} groups")
+        if len(groups) == 0:
+            return
         shuffle(groups)
-        groups.sort(key=len, reverse=True)
 
+        if len(tutor_capacities) > 0:
+            tutor_names, group_counts = self._parse_tutor_capacities(tutor_capacities, len(groups))
+        else:
+            tutor_names, group_counts = self._ask_tutor_capacities(len(groups))
+
+        # Every group costs its share of all students plus its share of all submitted data
+        student_count = sum(len(group) for group, _ in groups)
+        submission_size = sum(size for _, size in groups) or 1
+        costs = [len(group) / student_count + size / submission_size for group, size in groups]
+
+        tutor_groups = {tutor_name: [] for tutor_name in tutor_names}
+        tutor_sizes = defaultdict(int)
+        for (group, size), tutor_index in zip(groups, balanced_assignment(costs, group_counts)):
+            tutor_groups[tutor_names[tutor_index]].append(group)
+            tutor_sizes[tutor_names[tutor_index]] += size
+
+        tutor_group_counts = dict(zip(tutor_names, group_counts))
+        for tutor_name, tutor_group_count in tutor_group_counts.items():
+            assert tutor_group_count == len(tutor_groups[tutor_name]), f"Tutor {tutor_name} was assigned {len(tutor_groups[tutor_name])}, but {tutor_group_count} were requested."
+
+        columns = [tutor_names, [], [], []]
+        for tutor_name in tutor_names:
+            columns[1].append(len(tutor_groups[tutor_name]))
+            columns[2].append(sum(len(group) for group in tutor_groups[tutor_name]))
+            columns[3].append(f"{tutor_sizes[tutor_name] / 2 ** 20:.1f}")
+        self.printer.inform()
+        for line in string_table(["Tutor", "Groups", "Students", "Submitted MiB"], columns):
+            self.printer.inform(line)
+        self.printer.inform()
+
+        # One roster snapshot is shared by all tutors, every tutor package only holds the own name and students
+        meta_dir = Path(self._storage.storage_config.root) / "__meta__"
+        tutors_dir = Path(self._storage.storage_config.root) / "Tutors"
+        assert not tutors_dir.is_dir(), "Recreating tutors' directories, but they exist"
+        tutors_dir.mkdir()
+        # Never hardlinked, __meta__ is rewritten in place and the tutors must keep the state they were sent
+        copytree(meta_dir, tutors_dir / "__roster__", ignore=ignore_patterns(*AssignTutorsCommand.PERSONAL_META_FILES),
+                 copy_function=copy_function("reflink"))
+
+        assigned_students = set()
+        for tutor_name, own_groups in tutor_groups.items():
+            tutor_dir = tutors_dir / tutor_name / "__meta__"
+            (tutor_dir / "students").mkdir(parents=True)
+
+            with open(tutor_dir / "01_my_name.json", "w") as file:
+                dump(tutor_name, file)
+            with open(tutor_dir / "shared_meta.json", "w") as file:
+                dump({"path": "__roster__"}, file)
+
+            own_students = {student.muesli_student_id for group in own_groups for student in group}
+            assigned_students |= own_students
+            with open(tutor_dir / "students" / "included_students.json", "w") as file:
+                dump(sorted(own_students), file)
+
+        unassigned_students = {student.muesli_student_id for student in self._storage.all_students} - assigned_students
+        if len(unassigned_students) > 0:
+            self.printer.warning(f"{len(unassigned_students)} students did not hand in '{reference_sheet_name}' and are not assigned to anyone.")
+        self.printer.confirm(f"Send every tutor '{tutors_dir / '__roster__'}' and their own '__meta__' folder, both go into the root folder.")
+
+    def _parse_tutor_capacities(self, tutor_capacities, group_count):
+        tutor_names = []
+        capacities = []
+        for tutor_capacity in tutor_capacities:
+            tutor_name, _, capacity = tutor_capacity.rpartition(":")
+            tutor_name = tutor_name.strip()
+            if len(tutor_name) == 0 or not capacity.strip().isdigit():
+                raise ValueError(f"Expected a tutor of the form <name>:<capacity>, got '{tutor_capacity}'.")
+            if tutor_name in tutor_names:
+                raise ValueError(f"You already have {tutor_name} in your list.")
+            tutor_names.append(tutor_name)
+            capacities.append(int(capacity))
+
+        if sum(capacities) == 0:
+            raise ValueError("At least one tutor needs a capacity above 0.")
+        if sum(capacities) == group_count:
+            return tutor_names, capacities
+
+        group_counts = distribute(group_count, capacities)
+        self.printer.inform(f"The capacities do not add up to {group_count} groups, they are used as shares: " +
+                            ", ".join(f"{tutor_name}: {count}" for tutor_name, count in zip(tutor_names, group_counts)))
+        return tutor_names, group_counts
+
+    def _ask_tutor_capacities(self, group_count):
         # Let user specify names of tutorials and the number of groups in this tutorial
         tutor_names = [self._storage.my_name]
         while True:
@@ -92,51 +190,22 @@ class AssignTutorsCommand(Command):
         self.printer.inform(f"Here are your {len(tutor_names)} tutors: " + ", ".join(tutor_names))
         self.printer.inform()
 
-        remaining_groups = len(groups)
+        remaining_groups = group_count
         group_counts = []
         for i, tutor_name in enumerate(tutor_names[:-1]):
             while True:
                 try:
                     self.printer.inform(f"{len(tutor_names) - i} tutors remaining for {remaining_groups} groups.")
                     tutor_group_count = int(self.printer.ask(f"How many groups should {tutor_name} work with?"))
-                    group_counts.append(tutor_group_count)
-
-                    remaining_groups -= tutor_group_count
-                    if remaining_groups < 0:
+                    if tutor_group_count > remaining_groups:
                         self.printer.error("You specified more groups than were available")
                         continue
+                    group_counts.append(tutor_group_count)
+                    remaining_groups -= tutor_group_count
                     break
                 except ValueError:
                     self.printer.error("Not an integer, please try again.")
 
         group_counts.append(remaining_groups)
         self.printer.inform(f"Automatically assigned {remaining_groups} to {tutor_names[-1]}")
-
-        # Assign groups
-        tutor_groups = defaultdict(list)
-        tutor_group_counts = dict(zip(tutor_names, group_counts))
-        for group in groups:
-            next_tutor = min((name for name in tutor_names if len(tutor_groups[name]) < tutor_group_counts[name]), key=lambda name: (len(tutor_groups[name])))
-            tutor_groups[next_tutor].append(group)
-
-        for tutor_name, tutor_group_count in tutor_group_counts.items():
-            assert tutor_group_count == len(tutor_groups[tutor_name]), f"Tutor {tutor_name} was assigned {len(tutor_groups[tutor_name])}, but {tutor_group_count} were requested."
-
-        # Store assignments in ignore lists which can be sent to tutors to be put into their students directory
-        meta_dir = Path(self._storage.storage_config.root) / "__meta__"
-        tutors_dir = Path(self._storage.storage_config.root) / "Tutors"
-        assert not tutors_dir.is_dir(), "Recreating tutors' directories, but they exist"
-        tutors_dir.mkdir()
-        for tutor_name, own_groups in tutor_groups.items():
-            tutor_dir = tutors_dir / tutor_name / "__meta__"
-            copytree(meta_dir, tutor_dir)
-
-            with open(tutor_dir / "01_my_name.json", "w") as file:
-                dump(tutor_name, file)
-
-            own_students = [student.muesli_student_id for group in own_groups for student in group]
-            other_students = [student.muesli_student_id for student in self._storage.all_students if student not in own_students]
-            with open(tutor_dir / "students" / "imported_students.json", "w") as file:
-                dump(own_students, file)
-            with open(tutor_dir / "students" / "exported_students.json", "w") as file:
-                dump(other_students, file)
+        return tutor_names, group_counts
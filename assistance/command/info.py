@@ -1,9 +1,11 @@
 from assistance.command import Command
 from assistance.commands import normalize_string
+from data.credits import CreditStatistics
 from data.data import Student
 from data.storage import InteractiveDataStorage
 from util.collection import group
-from util.console import single_choice, print_header, string_card, align_horizontal, string_framed_line, align_vertical
+from util.console import single_choice, print_header, string_card, align_horizontal, string_framed_line, align_vertical, \
+    string_table
 
 
 class InfoCommand(Command):
@@ -15,11 +17,13 @@ Required Named Arguments (one of):
   ■ --student , -s: (partial) name of student [type: str]
   ■ --tutor   , -t: (partial) name of tutor [type: str]
   ■ --Tutorial, -T: id of tutorial in MÜSLI [type: int]
-  ■ --exercise, -e: number of the exercise [type: int]
+  ■ --exercise, -e: number of the exercise or 'all' for the credits of all exercises [type: int|str]
 Example usage:
   info -t="Christopher Schuster"
+  info -e=03
 """)
         self._storage = storage
+        self._credit_statistics = CreditStatistics(storage)
 
     def __call__(self, argument):
         parts = argument.split("=")
@@ -34,7 +38,7 @@ Example usage:
         elif name in ("--Tutorial", "-T"):
             self._print_tutorial_info(value)
         elif name in ("--exercise", "-e"):
-            raise NotImplementedError("This feature is not available (info.py: 50)")
+            self._print_exercise_info(value)
 
         else:
             raise ValueError(f"Unknown argument '{name}'")
@@ -122,6 +126,70 @@ Example usage:
         for line in lines:
             self.printer.inform(line)
 
+    def _print_exercise_info(self, value):
+        if value == "all":
+            self._print_all_exercises_info()
+            return
+
+        matrix = self._credit_statistics.load(value)
+        if matrix.number_of_students == 0:
+            self.printer.warning(f"No consolidated submissions found for exercise {value}, run workflow.consolidate {value} first.")
+            return
+
+        print_header(f'Exercise {value} ({matrix.number_of_students} students)', self.printer)
+
+        task_names = [f'Task {i + 1}' for i in range(matrix.number_of_tasks)]
+        if self._storage.has_exercise_meta(value):
+            max_credits = self._storage.load_exercise_meta(value).max_credits
+            if len(max_credits) == matrix.number_of_tasks:
+                task_names = [f'{task_name} ({credits})' for task_name, credits in max_credits]
+
+        rows = list(zip(task_names + ['Total'], [*matrix.task_summary(), matrix.total_summary()]))
+        self._print_summary_table(["Task"], [[name] for name, _ in rows], [summary for _, summary in rows])
+
+    def _print_all_exercises_info(self):
+        matrices = [matrix for matrix in self._credit_statistics.load_all() if matrix.number_of_students > 0]
+        if len(matrices) == 0:
+            self.printer.warning("No consolidated submissions found, run workflow.consolidate first.")
+            return
+
+        print_header(f'All exercises ({len(matrices)} sheets)', self.printer)
+        self._print_summary_table(
+            ["Exercise", "Students"],
+            [[matrix.exercise_number, matrix.number_of_students] for matrix in matrices],
+            [matrix.total_summary() for matrix in matrices]
+        )
+        self.printer.inform()
+
+        muesli_ids, running_totals = self._credit_statistics.running_totals(matrices)
+        names = [self._student_name(muesli_id) for muesli_id in muesli_ids]
+        order = sorted(range(len(names)), key=lambda row: names[row])
+        header = ["Student"] + [f'Total {matrix.exercise_number}' for matrix in matrices]
+        columns = [[names[row] for row in order]]
+        for column in range(len(matrices)):
+            columns.append([f'{running_totals[row, column]:g}' for row in order])
+        for line in string_table(header, columns):
+            self.printer.inform(line)
+
+    def _print_summary_table(self, header, labels, summaries):
+        header = header + ["Mean", "Min", "25%", "Median", "75%", "Max", "Zero"]
+        columns = [list() for _ in header]
+        for label, summary in zip(labels, summaries):
+            for i, entry in enumerate(label):
+                columns[i].append(entry)
+            for i, entry in enumerate(summary[:-1]):
+                columns[len(label) + i].append(f'{entry:.2f}')
+            columns[-1].append(f'{100 * summary[-1]:5.1f}%')
+
+        for line in string_table(header, columns):
+            self.printer.inform(line)
+
+    def _student_name(self, muesli_id):
+        try:
+            return self._storage.get_student_by_muesli_id(muesli_id).muesli_name
+        except ValueError:
+            return f'Unknown student ({muesli_id})'
+
 
 def select_student_by_name(value, storage, printer, action=None, mode='all', too_much_limit=11):
     value = normalize_string(value)
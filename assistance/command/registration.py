@@ -0,0 +1,84 @@
+import re
+
+from assistance.command import Command
+from data.storage import InteractiveDataStorage
+from mail.mail_in import EMailReceiver
+from util.console import string_table
+
+MAIL_ADDRESS = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+
+class GroupRegistrationCommand(Command):
+    def __init__(self, printer, storage: InteractiveDataStorage):
+        super().__init__(printer, "mail.registrations", ("m.reg",), 0, 1, help="""Fetches new group registration mails from the inbox and stores them in __meta__/group_registrations.json.
+Only mails that arrived since the last run are fetched, and only their headers and first text part.
+Aliases:
+  ■ m.reg
+Optional Arguments:
+  ■ --all: forget the stored registrations and fetch all registration mails again
+Example usage:
+  m.reg
+  m.reg --all
+""")
+        self._storage = storage
+
+    def __call__(self, *args):
+        if len(args) == 1 and args[0] != "--all":
+            raise ValueError(f"Unknown argument '{args[0]}'")
+
+        group_registration = getattr(getattr(self._storage.config, "mail", None), "group_registration", None)
+        subject = getattr(group_registration, "subject", None)
+        if subject is None:
+            self.printer.error("Please set mail.group_registration.subject in config.json.")
+            return
+        folder = getattr(group_registration, "folder", "Inbox")
+
+        state, _ = self._storage.physical_storage.load_group_registrations()
+        last_uid = 0 if len(args) == 1 else state["last_uid"]
+        registrations = list() if len(args) == 1 else state["registrations"]
+
+        with EMailReceiver(self._storage.email_account) as receiver:
+            uid_validity = receiver.select(folder)
+            if uid_validity != state["uid_validity"] and last_uid > 0:
+                self.printer.warning(f"The UIDs of '{folder}' changed, fetching all registration mails again.")
+                last_uid, registrations = 0, list()
+
+            uids = receiver.search_new(subject, last_uid)
+            self.printer.inform(f"Found {len(uids)} new registration mail(s).")
+            mails = receiver.fetch_first_text_parts(uids)
+
+        students_by_mail = {student.muesli_mail.lower(): student for student in self._storage.all_students if student.muesli_mail}
+        new_registrations = list()
+        for uid in uids:
+            if uid not in mails:
+                continue
+            registration = dict(mails[uid])
+            addresses = [registration["from_mail"]] + MAIL_ADDRESS.findall(registration["content"])
+            students = list()
+            for address in addresses:
+                student = students_by_mail.get(address.lower())
+                if student is not None and student not in students:
+                    students.append(student)
+            registration["muesli_student_ids"] = [student.muesli_student_id for student in students]
+            new_registrations.append((registration, students))
+
+        registrations.extend(registration for registration, _ in new_registrations)
+        self._storage.physical_storage.save_group_registrations({
+            "uid_validity": uid_validity,
+            "last_uid": max([last_uid] + uids),
+            "registrations": registrations
+        })
+
+        if len(new_registrations) > 0:
+            columns = [list(), list(), list()]
+            for registration, students in new_registrations:
+                columns[0].append(registration["date"] or "")
+                columns[1].append(registration["from_mail"])
+                columns[2].append(", ".join(student.muesli_name for student in students) or "-")
+            for line in string_table(["Date", "From", "Students"], columns, align_row='<'):
+                self.printer.inform(line)
+
+            unmatched = sum(1 for _, students in new_registrations if len(students) == 0)
+            if unmatched > 0:
+                self.printer.warning(f"{unmatched} registration(s) could not be matched to any student.")
+        self.printer.confirm(f"{len(registrations)} registration(s) stored.")
@@ -1,7 +1,7 @@
-import json
 import os
 import shutil
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from json import dump
 from json import dump as json_save
 from json import load as j_load
@@ -9,18 +9,20 @@ from os.path import join as p_join
 from pathlib import Path
 from types import SimpleNamespace
 from typing import List, Dict
-from zipfile import BadZipFile, ZipFile
-
-import numpy as np
+from zipfile import BadZipFile, ZIP_DEFLATED
 
 from assistance.command import Command
-from data.storage import InteractiveDataStorage, ensure_folder_exists
-from mail.mail_out import EMailSender
+from data.storage import InteractiveDataStorage, StudentNameIndex, ensure_folder_exists
+from mail.delivery import ConnectionSetupError, DeliveryPool, Mail, students_as_recipients
+from mail.outbox import FAILED, Outbox, PENDING, SENT
 from moodle.api import MoodleSession
 from muesli.api import MuesliSession
-from util.feedback import FeedbackPolisher
-from util.files import copy_files, filter_and, filter_name_end, filter_name_not_end, filter_not, filter_or
-from util.parse_names import FileNameParser, normalized_name
+from util.feedback import FeedbackPolisher, FeedbackTemplate
+from util.assignment import random_derangement
+from util.journal import JsonJournal
+from util.files import copy_file, copy_files, copy_function, data_fingerprint, directory_fingerprint, filter_and, filter_name_end, filter_name_not_end, filter_not, filter_or, write_zip, zip_entries
+from util.console import string_table
+from util.parse_names import AutomaticFileNameParser, NameAssignments, normalized_name, split_archive_name
 
 
 class WorkflowDownloadCommand(Command):
@@ -116,13 +118,22 @@ class WorkflowParseNamesCommand(Command):
     def __call__(self, exercise_number):
         ex_folder = Path(self._storage.get_exercise_folder(exercise_number))
         name_file = ex_folder / "names.json"
+        journal = JsonJournal(ex_folder / "names.journal")
 
         zip_file_names = self.find_zip_files(exercise_number)
         self.printer.inform(f"Found {len(zip_file_names)} input files.")
 
+        names = {}
         if name_file.is_file():
             with open(name_file, "r") as file:
                 names = j_load(file)
+
+        if journal.exists:
+            journal.replay(names)
+            self.printer.warning(f"Resuming an interrupted session: {len(journal)} resolutions were restored from {journal.path.name}.")
+            resume = True
+        elif name_file.is_file():
+            resume = False
             problems = [problem for prob_list in self.find_errors(names, zip_file_names) for problem in prob_list]
 
             self.printer.warning(f"{len(names)} names were already parsed.")
@@ -136,6 +147,8 @@ class WorkflowParseNamesCommand(Command):
                 answer = self.printer.ask("Please choose an option (a/b/c):")
                 if answer in "abc":
                     if answer == "a":
+                        # names.json is only replaced at the end, an interrupted restart must not resume from it
+                        journal.append_reset()
                         names = {}
                     elif answer == "b":
                         pass
@@ -143,52 +156,31 @@ class WorkflowParseNamesCommand(Command):
                         return
                     break
         else:
-            names = {}
+            resume = False
 
         try:
-            if len(names) == 0:
-                for file in zip_file_names:
-                    names[file] = self.parse_names_from_file(file, exercise_number)
-
-            self.fix_errors(names, exercise_number)
-        except:
-            if self.printer.yes_no("An error occurred. Do you want to store the current state?"):
-                with open(name_file, "w") as file:
-                    json_save(names, file, indent=4)
+            if len(names) == 0 or resume:
+                missing_files = [file for file in zip_file_names if file not in names]
+                names.update(self.parse_names_from_files(missing_files, exercise_number, journal))
+
+            self.fix_errors(names, exercise_number, journal)
+        except BaseException as e:
+            self.printer.error(f"Parsing was interrupted: {e!r}")
+            self.printer.inform(f"All resolved files are kept in {journal.path.name}, run {self.name} {exercise_number} again to resume.")
             return
 
         with open(name_file, "w") as file:
             json_save(names, file, indent=4)
+        journal.remove()
 
     def find_errors(self, names: Dict[str, dict], zip_file_names: List[str]):
-        handled_files = set()
-        handled_people: Dict[int, List[str]] = defaultdict(list)
-
-        removed_files = []
-        for file, file_info in names.items():
-            if file not in zip_file_names:
-                removed_files.append(file)
-
-            handled_files.add(file)
-            for person in file_info["muesli_student_ids"]:
-                handled_people[person].append(file)
-
-        people_double_assigned = []
-        for person, files in handled_people.items():
-            if len(files) > 1:
-                people_double_assigned.append((person, files))
-
-        unparsed_files = []
-        for zip_file_name in zip_file_names:
-            if zip_file_name not in handled_files:
-                unparsed_files.append(zip_file_name)
-
-        return removed_files, people_double_assigned, unparsed_files
+        return NameAssignments(names, zip_file_names).errors()
 
-    def fix_errors(self, names, exercise_number):
+    def fix_errors(self, names, exercise_number, journal: JsonJournal):
+        # The indexes are updated with every resolution, the folder is only scanned again after the user changed it
+        assignments = NameAssignments(names, self.find_zip_files(exercise_number))
         while True:
-            zip_file_names = self.find_zip_files(exercise_number)
-            removed_files, people_double_assigned, unparsed_files = self.find_errors(names, zip_file_names)
+            removed_files, people_double_assigned, unparsed_files = assignments.errors()
             if len(removed_files) > 0:
                 self.printer.warning(f"{len(removed_files)} are in the list of files that do not exist on the file system:")
                 self.printer.indent()
@@ -197,20 +189,24 @@ class WorkflowParseNamesCommand(Command):
                 self.printer.outdent()
                 if self.printer.yes_no("Do you want to remove them from the list of files?"):
                     for removed_file in removed_files:
-                        del names[removed_file]
+                        assignments.remove_entry(removed_file)
+                        journal.append_removal(removed_file)
+                else:
+                    assignments.update_files(self.find_zip_files(exercise_number))
                 continue
 
             if len(unparsed_files) > 0:
-                self.printer.warning(f"{len(removed_files)} are on the file system, but not parsed:")
+                self.printer.warning(f"{len(unparsed_files)} are on the file system, but not parsed:")
                 self.printer.indent()
                 for unparsed_file in unparsed_files:
                     self.printer.warning(f"- {unparsed_file}")
                 self.printer.outdent()
                 if self.printer.yes_no("Do you want to parse them now?"):
-                    for file in unparsed_files:
-                        names[file] = self.parse_names_from_file(file, exercise_number)
+                    for file, entry in self.parse_names_from_files(unparsed_files, exercise_number, journal).items():
+                        assignments.set_entry(file, entry)
                 else:
                     self.printer.ask("Please remove the files from the raw folder and hit enter.")
+                    assignments.update_files(self.find_zip_files(exercise_number))
                 continue
 
             if len(people_double_assigned) > 0:
@@ -226,14 +222,15 @@ class WorkflowParseNamesCommand(Command):
                         try:
                             selected_file = files[int(self.printer.ask("Correct assignment: "))]
                             break
-                        except (ValueError, KeyError):
+                        except (ValueError, IndexError):
                             pass
 
                     for file_name in files:
                         if file_name == selected_file:
                             pass
                         else:
-                            names[file_name]["muesli_student_ids"].remove(muesli_student_id)
+                            assignments.remove_student(file_name, muesli_student_id)
+                            journal.append(file_name, names[file_name])
 
             break
 
@@ -259,31 +256,64 @@ class WorkflowParseNamesCommand(Command):
                     zip_file_names.append(file_name)
         return zip_file_names
 
-    def parse_names_from_file(self, file, exercise_number):
-        if file.endswith(".tar.gz"):
-            extension = ".tar.gz"
-            file_name = file[:len(extension)]
-        else:
-            file_name, extension = os.path.splitext(file)
-
-        name_parser = FileNameParser(self.printer, self._storage, file_name, exercise_number)
+    def parse_names_from_files(self, files, exercise_number, journal: JsonJournal):
+        # First pass: match everything that is unambiguous without asking
+        index = StudentNameIndex(self._storage.all_students)
+        names = {}
+        queued = []
+        for file in files:
+            file_name, extension = split_archive_name(file)
+            name_parser = AutomaticFileNameParser(self.printer, self._storage, file_name, exercise_number, index)
+            if name_parser.resolved:
+                names[file] = self._name_entry(file, extension, name_parser)
+            else:
+                queued.append((file, extension, name_parser))
+        journal.extend(names.items())
+
+        self.printer.inform(f"Parsed {len(names)} of {len(files)} files automatically.")
+        self._print_problems(names)
+        if len(queued) == 0:
+            return names
+
+        # Second pass: show everything that needs help at once, then resolve it
+        self.printer.warning(f"{len(queued)} files need your help:")
+        header = ["File", "Found", "Unresolved"]
+        columns = [list(), list(), list()]
+        for file, _, name_parser in queued:
+            columns[0].append(file)
+            columns[1].append(", ".join(student.muesli_name for student in name_parser.students))
+            if name_parser.failure is not None:
+                columns[2].append(str(name_parser.failure))
+            else:
+                columns[2].append(", ".join(f"{name} ({len(candidates)} matches)" for name, candidates in name_parser.unresolved))
+        with self.printer:
+            for line in string_table(header, columns, align_row='<'):
+                self.printer.inform(line)
+        self.printer.inform()
+
+        for file, extension, name_parser in queued:
+            self.printer.inform("─" * 100)
+            name_parser.resolve()
+            self.printer.inform("Found: " + ", ".join([student.muesli_name for student in name_parser.students]))
+            names[file] = self._name_entry(file, extension, name_parser)
+            journal.append(file, names[file])
+            self.printer.confirm("[OK]")
+
+        return names
+
+    def _print_problems(self, names):
+        files_with_problems = [(file, entry["problems"]) for file, entry in names.items() if len(entry["problems"]) > 0]
+        if len(files_with_problems) > 0:
+            self.printer.warning(f"{len(files_with_problems)} of them have naming problems, which will be reported to the students:")
+            with self.printer:
+                for file, problems in files_with_problems:
+                    self.printer.warning(f"- {file}: {problems[0]}" + (f" (+{len(problems) - 1} more)" if len(problems) > 1 else ""))
+
+    def _name_entry(self, file, extension, name_parser):
         problems = list(name_parser.problems)
-
         if not extension.endswith("zip"):
             problems.append(f"Minor: Wrong archive format, please use '.zip' instead of '{extension}'.")
 
-        self.printer.inform("Found: " + ", ".join([student.muesli_name for student in name_parser.students]))
-        if len(problems) > 0:
-            self.printer.inform()
-            self.printer.warning("While normalizing name there were some problems:")
-            self.printer.indent()
-            for problem in problems:
-                self.printer.warning("- " + problem)
-            self.printer.outdent()
-            self.printer.ask("Hit enter to continue")
-
-        self.printer.confirm("[OK]")
-        self.printer.inform("─" * 100)
         return {
             "original_name": file,
             "problems": problems,
@@ -314,7 +344,15 @@ class WorkflowUnzipCommand(Command):
 
         raw_folder = Path(self._storage.get_raw_folder(exercise_number))
         preprocessed_folder = Path(self._storage.get_preprocessed_folder(exercise_number))
+        preprocessed_folder.mkdir(parents=True, exist_ok=True)
+        submission_index = self._storage.get_submission_index(exercise_number)
 
+        try:
+            self._unzip_all(names, raw_folder, preprocessed_folder, submission_index, skip_existing)
+        finally:
+            submission_index.save()
+
+    def _unzip_all(self, names, raw_folder, preprocessed_folder, submission_index, skip_existing):
         for file, data in names.items():
             problems = data["problems"]
             zip_path = raw_folder / file
@@ -367,7 +405,7 @@ class WorkflowUnzipCommand(Command):
                             self.printer.error(
                                 f"Fatal error: {file} could not be unpacked!")
                             self.printer.error("[ERR]")
-                            shutil.copy(zip_path, target_path)
+                            copy_file(zip_path, target_path, self._storage.copy_mode)
                             self.printer.inform("Copied zip file to target.")
                         else:
                             problems.append(problem)
@@ -392,10 +430,11 @@ class WorkflowUnzipCommand(Command):
                     raise ValueError(
                         "Found invalid file name, aborting due to user request.")
                 elif answer[0] == "l":
-                    shutil.copy(zip_path, target_path)
+                    copy_file(zip_path, target_path, self._storage.copy_mode)
 
             with open(target_path / "submission_meta.json", 'w') as fp:
                 json_save(data, fp)
+            submission_index.update(target_path.name, data)
 
 
 def is_zip_file(file):
@@ -404,60 +443,63 @@ def is_zip_file(file):
 
 class WorkflowSendConfirmation(Command):
     def __init__(self, printer, storage: InteractiveDataStorage):
-        super().__init__(printer, "workflow.confirm", ("w.confirm",), 1, 2)
+        super().__init__(printer, "workflow.confirm", ("w.confirm",), 1, 3)
 
         self._storage = storage
 
-    def __call__(self, exercise_number, debug_flag=False):
+    def __call__(self, *args):
+        exercise_number, flags = parse_mail_flags(args)
+        debug_flag = "--debug" in flags
         preprocessed_folder = Path(self._storage.get_preprocessed_folder(exercise_number))
 
-        if debug_flag == "--debug":
-            debug_flag = True
-        elif debug_flag is not False:
-            raise ValueError(f"Invalid argument {debug_flag!r}.")
-
         if not preprocessed_folder.is_dir():
             self.printer.error(f"The data for exercise {exercise_number} was not extracted. Run workflow.unzip first.")
             return
 
-        with EMailSender(self._storage.email_account, self._storage.my_name) as sender:
-            for src_directory in preprocessed_folder.iterdir():
-                if src_directory.name.startswith("."):
+        outbox = Outbox(self._storage.get_outbox_folder(exercise_number, "confirmation"))
+        send_mails(outbox, self._render(exercise_number, outbox, debug_flag), self._storage, self.printer, flags)
+
+    def _render(self, exercise_number, outbox, debug_flag):
+        # Everything is rendered in one pass over the submission index before the first mail is sent
+        subject = f'[Fundamentals of Machine Learning] Your submission to {self._storage.muesli_data.exercise_prefix} {exercise_number} was received'
+        mails = list()
+        for src_directory, submission_info in self._storage.get_submission_index(exercise_number).items():
+            new_line = '\n'
+
+            problems = submission_info["problems"]
+            if len(problems) > 0:
+                problem_string = "Assigning the names was not easy; these issues occurred when parsing:"
+                problem_string += '\n'.join("- " + problem for problem in problems)
+            else:
+                problem_string = "There were no issues parsing the file name. You are awesome!"
+
+            students = [self._storage.get_student_by_muesli_id(muesli_student_id) for muesli_student_id in submission_info["muesli_student_ids"]]
+            student_list = new_line.join('- ' + student.muesli_name for student in students)
+            for student in students:
+                key = f"{src_directory.name}_{student.muesli_student_id}"
+                if not debug_flag and outbox.state(key) not in (None, PENDING):
                     continue
-                with open(src_directory / "submission_meta.json", "rb") as file:
-                    submission_info = j_load(file)
-                new_line = '\n'
-
-                problems = submission_info["problems"]
-                if len(problems) > 0:
-                    problem_string = "Assigning the names was not easy; these issues occurred when parsing:"
-                    problem_string += '\n'.join("- " + problem for problem in problems)
-                else:
-                    problem_string = "There were no issues parsing the file name. You are awesome!"
 
-                students = [self._storage.get_student_by_muesli_id(muesli_student_id) for muesli_student_id in submission_info["muesli_student_ids"]]
-                for student in students:
-                    message = f"""Dear {student.muesli_name},
+                message = f"""Dear {student.muesli_name},
     
 you or a team mate uploaded {submission_info["original_name"]!r} to Moodle as a hand in to sheet {exercise_number}.
 We associate this hand in to the following students:
-{new_line.join('- ' + student.muesli_name for student in students)}
+{student_list}
 
 {problem_string}
 
 Have an awesome day!
 {self._storage.my_name}
 """
+                mails.append((key, Mail(
+                    students_as_recipients([student]),
+                    message,
+                    subject,
+                    debug=debug_flag,
+                    label=student.moodle_name
+                )))
 
-                    self.printer.inform(f"Sending confirmation email to {student.moodle_name} ... ", end='')
-
-                    try:
-                        sender.send_mail([student], message, f'[Fundamentals of Machine Learning] Your submission to {self._storage.muesli_data.exercise_prefix} {exercise_number} was received', debug=debug_flag)
-                        self.printer.confirm("[Ok]")
-                    except BaseException as e:
-                        self.printer.error(f"[Err] - {e}")
-
-                self.printer.inform("─" * 100)
+        return mails
 
 
 class WorkflowPrepareCommand(Command):
@@ -488,65 +530,114 @@ class WorkflowPrepareCommand(Command):
         can_generate_feedback = self.load_muesli_data(exercise_number)
 
         if next_exercise_number is not None:
-            all_next_submissions = self.load_next_submissions(next_exercise_number)
+            next_index = self.load_next_submissions(next_exercise_number)
+            all_next_submissions = next_index.by_muesli_id()
             cross_assignments = self.load_cross_assignments(exercise_number)
         else:
+            next_index = None
             all_next_submissions = {}
-            cross_assignments = []
-
-        my_student_muesli_ids = [student.muesli_student_id for student in self._storage.my_students]
-        for src_directory in preprocessed_folder.iterdir():
-            if src_directory.name.startswith("."):
-                continue
-            with open(src_directory / "submission_meta.json", "rb") as file:
-                submission_info = j_load(file)
+            cross_assignments = {}
+
+        # Fingerprints of everything a working directory was prepared from, so that re-runs only handle the deltas
+        state_file = working_folder / ".prepare_state.json"
+        previous_state = {}
+        if state_file.is_file():
+            with open(state_file, "r", encoding="utf-8") as file:
+                previous_state = j_load(file)
+        state = {}
+
+        index = self._storage.get_submission_index(exercise_number)
+        changes = []
+        unchanged_count = 0
+        missing_cross_feedback = []
+        template = FeedbackTemplate(self._storage, exercise_number) if can_generate_feedback else None
+        my_student_muesli_ids = {student.muesli_student_id for student in self._storage.my_students}
+        try:
+            for src_directory, submission_info in index.items():
+                submission_muesli_ids = submission_info["muesli_student_ids"]
+                any_own_student_detected = any(muesli_id in my_student_muesli_ids for muesli_id in submission_muesli_ids)
+                if not any_own_student_detected:
+                    continue
 
-            submission_muesli_ids = submission_info["muesli_student_ids"]
-            any_own_student_detected = any(muesli_id in my_student_muesli_ids for muesli_id in submission_muesli_ids)
+                name = src_directory.name
+                target_directory = working_folder / name
+                own_submissions = self.find_own_feedback(submission_muesli_ids, all_next_submissions)
+                cross_submissions, cross_assigned = self.find_cross_feedback(cross_assignments, submission_muesli_ids, all_next_submissions)
+                fingerprints = {
+                    "submission": data_fingerprint(index.files(name)),
+                    "template": can_generate_feedback,
+                    "own": {folder.name: data_fingerprint(next_index.files(folder.name)) for folder in own_submissions},
+                    "cross": {folder.name: data_fingerprint(next_index.files(folder.name)) for folder in cross_submissions},
+                }
+
+                previous = previous_state.get(name) if target_directory.is_dir() else None
+                if previous is not None and previous["fingerprints"] == fingerprints:
+                    state[name] = previous
+                    unchanged_count += 1
+                    if previous["cross_missing"]:
+                        missing_cross_feedback.append(name)
+                    continue
 
-            if any_own_student_detected:
                 not_my_students = [self._storage.get_student_by_muesli_id(muesli_id) for muesli_id in submission_muesli_ids if muesli_id not in my_student_muesli_ids]
                 if len(not_my_students) > 0:
-                    self.printer.warning(f"There are students among {src_directory.name} who do not belong to your group: {', '.join([student.muesli_name for student in not_my_students])}.")
+                    self.printer.warning(f"There are students among {name} who do not belong to your group: {', '.join([student.muesli_name for student in not_my_students])}.")
                     if not self.printer.yes_no("Please talk to the head tutor. Continue anyway?", default="n"):
                         return
 
-                target_directory = working_folder / src_directory.name
                 if not target_directory.is_dir():
-                    shutil.copytree(src_directory, target_directory)
-                if can_generate_feedback and target_directory.is_dir():
-                    self._storage.generate_feedback_template(exercise_number, target_directory, self.printer)
+                    shutil.copytree(src_directory, target_directory, copy_function=copy_function(self._storage.copy_mode))
+                # Written right away, the state below must only claim templates which exist
+                template_missing = previous is None or not previous["fingerprints"]["template"]
+                if template is not None and template_missing and target_directory.is_dir():
+                    template.write_all([(target_directory, submission_info)], self.printer)
+
+                self.copy_own_feedback(own_submissions, target_directory)
+                cross_missing = cross_assigned and self.copy_cross_feedback(cross_submissions, target_directory) == 0
+                if cross_missing:
+                    missing_cross_feedback.append(name)
+
+                state[name] = {"fingerprints": fingerprints, "cross_missing": cross_missing}
+                changes.append((name, describe_prepare_changes(previous, fingerprints)))
+        finally:
+            # Keep the state of submissions which were not visited, e.g. after aborting
+            with open(state_file, "w", encoding="utf-8") as file:
+                json_save({**previous_state, **state}, file, indent=4)
+
+        self.printer.inform(f"Prepared {len(changes)} new or changed submissions, {unchanged_count} were unchanged.")
+        with self.printer:
+            for name, reasons in sorted(changes):
+                self.printer.inform(f"- {name}: {', '.join(reasons)}")
+
+        if len(missing_cross_feedback) > 0:
+            self.printer.warning(f"No cross feedback was found for {len(missing_cross_feedback)} of your submissions although it was assigned:")
+            with self.printer:
+                for submission_name in sorted(missing_cross_feedback):
+                    self.printer.warning(f"- {submission_name}")
+
+    def find_own_feedback(self, submission_muesli_ids, all_next_submissions):
+        return {all_next_submissions[muesli_id] for muesli_id in submission_muesli_ids if muesli_id in all_next_submissions}
+
+    def find_cross_feedback(self, cross_assignments, submission_muesli_ids, all_next_submissions):
+        reviewer_muesli_ids = set()
+        for submission_muesli_id in submission_muesli_ids:
+            reviewer_muesli_ids.update(cross_assignments.get(submission_muesli_id, ()))
 
-                self.copy_own_feedback(submission_muesli_ids, all_next_submissions, target_directory)
-                self.copy_cross_feedback(cross_assignments, submission_muesli_ids, all_next_submissions, target_directory)
+        next_cross_submissions = {all_next_submissions[muesli_id] for muesli_id in reviewer_muesli_ids if muesli_id in all_next_submissions}
+        return next_cross_submissions, len(reviewer_muesli_ids) > 0
 
-    def copy_own_feedback(self, submission_muesli_ids, all_next_submissions, target_directory):
-        next_own_submissions = set()
-        for submission_muesli_id in submission_muesli_ids:
-            if submission_muesli_id in all_next_submissions:
-                next_own_submissions.add(all_next_submissions[submission_muesli_id])
+    def copy_own_feedback(self, next_own_submissions, target_directory):
         for next_own_submission in next_own_submissions:
             # Find files ending with commented.X and copy them over
             self_target = target_directory / f"Own feedback by {next_own_submission.name}"
-            if not self_target.is_dir():
-                self_target.mkdir()
-            copy_files(next_own_submission, self_target, WorkflowPrepareCommand.FILTER_SELF_COMMENT)
-
-    def copy_cross_feedback(self, cross_assignments, submission_muesli_ids, all_next_submissions, target_directory):
-        next_cross_submissions = set()
-        for solution_by_muesli_ids, was_assigned_to_muesli_ids in cross_assignments:
-            any_prev = any(solution_by_muesli_id in submission_muesli_ids for solution_by_muesli_id in solution_by_muesli_ids)
-            any_feedback = any(was_assigned_to_muesli_id in all_next_submissions for was_assigned_to_muesli_id in was_assigned_to_muesli_ids)
-            if any_prev and any_feedback:
-                for was_assigned_to_muesli_id in was_assigned_to_muesli_ids:
-                    if was_assigned_to_muesli_id in all_next_submissions:
-                        next_cross_submissions.add(all_next_submissions[was_assigned_to_muesli_id])
+            copy_files(next_own_submission, self_target, WorkflowPrepareCommand.FILTER_SELF_COMMENT, self._storage.copy_mode)
+
+    def copy_cross_feedback(self, next_cross_submissions, target_directory):
+        copied_files = 0
         for next_cross_submission in next_cross_submissions:
             # Find files ending with cross[-_]commented.X and copy them over
             cross_target = target_directory / f"Cross by {next_cross_submission.name}"
-            if not cross_target.is_dir():
-                cross_target.mkdir()
-            copy_files(next_cross_submission, cross_target, WorkflowPrepareCommand.FILTER_CROSS_COMMENT)
+            copied_files += copy_files(next_cross_submission, cross_target, WorkflowPrepareCommand.FILTER_CROSS_COMMENT, self._storage.copy_mode)
+        return copied_files
 
     def load_muesli_data(self, exercise_number):
         can_generate_feedback = False
@@ -564,67 +655,170 @@ class WorkflowPrepareCommand(Command):
         return can_generate_feedback
 
     def load_cross_assignments(self, exercise_number):
+        # Maps the MÜSLI id of each author to the MÜSLI ids of everyone who was assigned to review the submission
         assignment_file = Path(self._storage.get_exercise_folder(exercise_number)) / "cross-assignments.json"
-        assignments = []
+        reviewers_by_author = defaultdict(set)
         if not assignment_file.is_file():
             if self.printer.yes_no("cross-assignments.json was not found. Do you want to continue anyway?", None):
-                return assignments
+                return reviewers_by_author
             else:
                 raise NotImplementedError("Don't worry about this error")
 
-        with open(assignment_file, "r") as file:
-            data = j_load(file)
-            for assignment in data:
-                assignments.append((
-                    assignment["submission_by_muesli_student_ids"],
-                    assignment["assigned_to_muesli_student_ids"]
-                ))
-        return assignments
+        return read_cross_reviewers(assignment_file)
 
     def load_next_submissions(self, next_exercise_number):
-        next_exercise_unpacked_folder = Path(self._storage.get_preprocessed_folder(next_exercise_number))
-        all_next_submissions = {}
-        for next_submission in next_exercise_unpacked_folder.iterdir():
-            next_meta = Path(next_submission / "submission_meta.json")
-            if next_meta.is_file():
-                with open(next_meta, "r") as file:
-                    for muesli_id in j_load(file)["muesli_student_ids"]:
-                        all_next_submissions[muesli_id] = next_submission
-        return all_next_submissions
+        return self._storage.get_submission_index(next_exercise_number)
+
+
+def read_cross_assignments(path):
+    # Either the list written by w.cross or the indexed file written by w.merge
+    with open(path, "r") as file:
+        data = j_load(file)
+    if isinstance(data, dict):
+        return data["assignments"]
+    return data
+
+
+def read_cross_reviewers(path):
+    with open(path, "r") as file:
+        data = j_load(file)
+    if isinstance(data, dict):
+        reviewers_by_author = defaultdict(set)
+        for author_muesli_id, reviewer_muesli_ids in data["reviewers_by_author"].items():
+            reviewers_by_author[int(author_muesli_id)].update(reviewer_muesli_ids)
+        return reviewers_by_author
+    return index_cross_assignments(data)
+
+
+def index_cross_assignments(assignments):
+    reviewers_by_author = defaultdict(set)
+    for assignment in assignments:
+        for author_muesli_id in assignment["submission_by_muesli_student_ids"]:
+            reviewers_by_author[author_muesli_id].update(assignment["assigned_to_muesli_student_ids"])
+    return reviewers_by_author
+
+
+def describe_prepare_changes(previous, fingerprints):
+    if previous is None:
+        return ["new"]
+
+    previous = previous["fingerprints"]
+    reasons = []
+    if previous["submission"] != fingerprints["submission"]:
+        reasons.append("submission changed (working copy kept)")
+    if previous["template"] != fingerprints["template"]:
+        reasons.append("feedback template")
+    for kind, label in (("own", "own feedback"), ("cross", "cross feedback")):
+        for name, fingerprint in fingerprints[kind].items():
+            if name not in previous[kind]:
+                reasons.append(f"new {label} by {name}")
+            elif previous[kind][name] != fingerprint:
+                reasons.append(f"updated {label} by {name}")
+        for name in previous[kind].keys() - fingerprints[kind].keys():
+            reasons.append(f"{label} by {name} is gone (copy kept)")
+    return reasons
 
 
 class WorkflowConsolidate(Command):
+    WORKERS = 8
+
     def __init__(self, printer, storage):
-        super().__init__(printer, "workflow.consolidate", ("w.cons",), 1, 1)
+        super().__init__(printer, "workflow.consolidate", ("w.cons",), 1, 2)
         self._storage = storage
 
-    def __call__(self, *args):
-        exercise_number = args[0]
+    def __call__(self, exercise_number, force=False):
+        if force == "--force":
+            force = True
+        elif force is not False:
+            raise ValueError(f"Did not understand second parameter {force}, should be '--force' or nothing.")
+
         working_folder = Path(self._storage.get_working_folder(exercise_number))
         finished_folder = Path(self._storage.get_finished_folder(exercise_number))
 
-        for directory in working_folder.iterdir():
-            if directory.name.startswith("."):
-                continue
+        directories = sorted(directory for directory in working_folder.iterdir() if directory.is_dir() and not directory.name.startswith("."))
 
-            self.printer.inform()
-            self.printer.inform(f"Working in {directory.name}")
-            self.printer.inform("Polishing feedback ... ", end='')
-            polisher = FeedbackPolisher(
-                self._storage,
-                directory,
-                self.printer
-            )
-            self.printer.confirm("[Ok]")
-            self.printer.inform("Saving meta data   ... ", end='')
-            target_directory = finished_folder / directory.name
-            polisher.save_meta_to_folder(target_directory)
+        # Feedback files are checked against the tasks of the exercise, if they are known
+        exercise_meta = None
+        if self._storage.has_exercise_meta(exercise_number):
+            exercise_meta = self._storage.load_exercise_meta(exercise_number)
+        else:
+            self.printer.warning("No exercise meta data found, the tasks of the feedback files are not checked.")
 
-            feedback_directory = target_directory / "Original and Comments"
-            if not feedback_directory.is_dir():
-                feedback_directory.mkdir()
-            copy_files(directory, feedback_directory, filter_and(filter_name_not_end("Feedback"), filter_name_not_end("submission_meta")))
-            self.printer.confirm("[Ok]")
+        self.printer.inform(f"Consolidating {len(directories)} submissions ...")
+
+        # Failures are collected per submission, so that one broken feedback does not stop the others
+        results = dict()
+        with ThreadPoolExecutor(max_workers=WorkflowConsolidate.WORKERS) as executor:
+            futures = {executor.submit(self._consolidate, directory, finished_folder, exercise_meta, force): directory for directory in directories}
+            for future in as_completed(futures):
+                directory = futures[future]
+                try:
+                    credits_per_task, changed = future.result()
+                    results[directory.name] = (credits_per_task, changed, None)
+                    if changed:
+                        self.printer.confirm(f"[Ok]  {directory.name}")
+                except Exception as e:
+                    results[directory.name] = (None, True, f"{e.__class__.__name__}: {e}")
+                    self.printer.error(f"[Err] {directory.name}")
+
+        self.printer.inform()
+        self._print_summary(results)
+
+    def _consolidate(self, directory, finished_folder, exercise_meta, force):
+        target_directory = finished_folder / directory.name
+        source_fingerprint = directory_fingerprint(directory)
+
+        # Skip groups whose feedback and comments did not change since the last successful run
+        meta_path = target_directory / "meta.json"
+        if not force and meta_path.is_file():
+            with open(meta_path, 'r', encoding="utf-8") as fp:
+                meta = j_load(fp)
+            if meta.get("source_fingerprint") == source_fingerprint:
+                return meta["credits_per_task"], False
+
+        polisher = FeedbackPolisher(
+            self._storage,
+            directory,
+            self.printer,
+            exercise_meta
+        )
+
+        feedback_directory = target_directory / "Original and Comments"
+        feedback_directory.mkdir(parents=True, exist_ok=True)
+        copy_files(directory, feedback_directory, filter_and(filter_name_not_end("Feedback"), filter_name_not_end("submission_meta")), self._storage.copy_mode, max_workers=1)
+
+        # The fingerprint is only stored once everything was written
+        polisher.save_meta_to_folder(target_directory, source_fingerprint)
+
+        return polisher.credits_per_task, True
+
+    def _print_summary(self, results):
+        header = ["Submission", "Status", "Credits", "Error"]
+        columns = [list(), list(), list(), list()]
+        total_credits = 0
+        failures = 0
+        for name, (credits_per_task, changed, error) in sorted(results.items()):
+            columns[0].append(name)
+            if error is None:
+                columns[1].append("Ok" if changed else "Unchanged")
+                columns[2].append(f"{sum(credits_per_task):g}")
+                columns[3].append("")
+                total_credits += sum(credits_per_task)
+            else:
+                failures += 1
+                columns[1].append("Error")
+                columns[2].append("-")
+                columns[3].append(error)
+
+        for line in string_table(header, columns, align_row='<'):
+            self.printer.inform(line)
+        self.printer.inform()
+
+        successes = len(results) - failures
+        unchanged = sum(1 for _, changed, error in results.values() if not changed)
+        self.printer.inform(f"Consolidated {successes} of {len(results)} submissions ({unchanged} unchanged) with a total of {total_credits:g} credits.")
+        if failures > 0:
+            self.printer.error(f"{failures} submissions failed, please fix them and run {self.name} again.")
 
 
 class WorkflowUpload(Command):
@@ -640,6 +834,11 @@ class WorkflowUpload(Command):
 
         data = defaultdict(dict)
 
+        number_of_tasks = None
+        if self._storage.has_exercise_meta(exercise_number):
+            number_of_tasks = len(self._storage.load_exercise_meta(exercise_number).max_credits)
+
+        invalid = list()
         for directory in os.listdir(finished_folder):
             meta_path = p_join(finished_folder, directory, meta_file_name)
             if not os.path.isfile(meta_path):
@@ -648,10 +847,21 @@ class WorkflowUpload(Command):
 
             with open(meta_path, 'r', encoding="utf-8") as fp:
                 meta = SimpleNamespace(**j_load(fp))
+                if number_of_tasks is not None and len(meta.credits_per_task) != number_of_tasks:
+                    invalid.append(f"{directory} has credits for {len(meta.credits_per_task)} instead of {number_of_tasks} tasks")
+                    continue
                 for muesli_id in meta.muesli_ids:
                     student = self._storage.get_student_by_muesli_id(muesli_id)
                     data[student.tutorial_id][muesli_id] = meta.credits_per_task
 
+        if len(invalid) > 0:
+            self.printer.error("The credits of the following submissions do not match the exercise:")
+            for problem in invalid:
+                self.printer.error(f"  ■ {problem}")
+            self.printer.error("Please fix their feedback and run workflow.consolidate again.")
+            if not self.printer.yes_no("Do you want to upload the credits of the other submissions anyway?", "n"):
+                return
+
         with self._muesli:
             for tutorial_id, student_data in data.items():
                 tutorial = self._storage.get_tutorial_by_id(tutorial_id)
@@ -674,6 +884,8 @@ class WorkflowUpload(Command):
 
 
 class WorkflowZipCommand(Command):
+    WORKERS = os.cpu_count()
+
     def __init__(self, printer, storage: InteractiveDataStorage):
         super().__init__(printer, "workflow.zip", ("w.zip",), 1, 1)
         self._storage = storage
@@ -683,64 +895,104 @@ class WorkflowZipCommand(Command):
         mampf_folder = finished_folder / 'Mampf_Corrections'
         mampf_folder.mkdir(parents=True, exist_ok=True)
 
-        for submission_folder in finished_folder.iterdir():
-            if submission_folder.is_dir():
-                if submission_folder != mampf_folder:
-                    with open(submission_folder / "meta.json", "r") as file:
+        # Fingerprints of the submission folders the zips were built from, unchanged zips are not built again
+        state_file = mampf_folder / ".zip_state.json"
+        previous_state = {}
+        if state_file.is_file():
+            with open(state_file, "r", encoding="utf-8") as file:
+                previous_state = j_load(file)
+        state = {}
+
+        jobs = list()
+        with os.scandir(finished_folder) as entries:
+            submission_folders = sorted(entry.path for entry in entries if entry.is_dir() and entry.path != str(mampf_folder))
+        for submission_folder in submission_folders:
+            name = os.path.basename(submission_folder)
+            meta_path = p_join(submission_folder, "meta.json")
+            if not os.path.isfile(meta_path):
+                self.printer.inform(f"Skipping {name}")
+                continue
 
-                        meta_info = json.load(file)
-                        with ZipFile(mampf_folder / meta_info['original_name'], 'w') as zipF:
-                            for file in ['Original and Comments','Feedback.txt']:
-                                if file == 'Feedback.txt':
-                                    zipF.write(filename=submission_folder / file, arcname=file)
-                                else:
-                                    self._zipdir(submission_folder /file, zipF, file)
+            with open(meta_path, "r", encoding="utf-8") as file:
+                target = mampf_folder / j_load(file)['original_name']
+            fingerprint = directory_fingerprint(submission_folder)
+            if previous_state.get(name) == fingerprint and target.is_file():
+                state[name] = fingerprint
+            else:
+                jobs.append((name, submission_folder, target, fingerprint))
 
-        print('Corrections ready to upload for Mampf: 05_Fertig/Mampf_Corrections')
+        unchanged_count = len(state)
+        failures = 0
+        try:
+            if len(jobs) > 0:
+                with ProcessPoolExecutor(max_workers=min(WorkflowZipCommand.WORKERS, len(jobs))) as executor:
+                    futures = {executor.submit(build_mampf_zip, submission_folder, target): (name, fingerprint) for name, submission_folder, target, fingerprint in jobs}
+                    for future in as_completed(futures):
+                        name, fingerprint = futures[future]
+                        try:
+                            future.result()
+                            state[name] = fingerprint
+                            self.printer.confirm(f"[Ok]  {name}")
+                        except Exception as e:
+                            failures += 1
+                            self.printer.error(f"[Err] {name}: {e.__class__.__name__}: {e}")
+        finally:
+            with open(state_file, "w", encoding="utf-8") as file:
+                json_save(state, file, indent=4)
 
-    def _zipdir(self,path, ziph, arcname):
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                ziph.write(os.path.join(root, file), 
-                    os.path.relpath(os.path.join(root, file), 
-                        os.path.join(path, '..')))
+        self.printer.inform(f"Zipped {len(jobs) - failures} new or changed submissions, {unchanged_count} were unchanged.")
+        if failures > 0:
+            self.printer.error(f"{failures} submissions failed, please fix them and run {self.name} again.")
+        self.printer.inform('Corrections ready to upload for Mampf: 05_Fertig/Mampf_Corrections')
 
-class WorkflowSendMail(Command):
-    def __init__(self, printer, storage: InteractiveDataStorage):
-        super().__init__(printer, "workflow.send_feedback", ("w.send",), 1, 2)
-        self._storage = storage
 
-    def _parse_arguments(self, args):
-        if len(args) == 1:
-            exercise_number = args[0]
-            debug = False
-        else:
-            if args[0].lower() == '--debug':
-                debug = True
-                exercise_number = args[1]
-            else:
-                exercise_number = args[0]
-                debug = args[1].lower() == '--debug'
+def build_mampf_zip(submission_folder, target):
+    # Runs in a worker process
+    entries = zip_entries(p_join(submission_folder, 'Original and Comments'), submission_folder)
+    entries.append((p_join(submission_folder, 'Feedback.txt'), 'Feedback.txt'))
 
-                if not debug:
-                    raise ValueError(f'Unexpected flag {args[1]}')
+    write_zip(target, entries)
 
-        return exercise_number, debug
+
+class WorkflowSendMail(Command):
+    # MiB, many mail servers reject mails above 20 to 25 MiB and base64 adds a third
+    MAX_ATTACHMENT_SIZE = 15
+
+    def __init__(self, printer, storage: InteractiveDataStorage):
+        super().__init__(printer, "workflow.send_feedback", ("w.send",), 1, 3)
+        self._storage = storage
 
     def __call__(self, *args):
-        exercise_number, debug = self._parse_arguments(args)
+        exercise_number, flags = parse_mail_flags(args)
+        debug = "--debug" in flags
         if debug:
             self.printer.confirm("Running in debug mode.")
 
+        outbox = Outbox(self._storage.get_outbox_folder(exercise_number, "feedback"))
+        send_mails(outbox, self._render(exercise_number, outbox, debug, "--dry-run" in flags), self._storage, self.printer, flags)
+
+    def _render(self, exercise_number, outbox, debug, dry_run=False):
         finished_folder = Path(self._storage.get_finished_folder(exercise_number))
         feedback_file_name = f"{self._storage.muesli_data.feedback.file_name}.txt"
         meta_file_name = "meta.json"
+        attachment_limit = getattr(self._storage.mail_delivery, "max_attachment_size", WorkflowSendMail.MAX_ATTACHMENT_SIZE)
+
+        # Fingerprints of the folders the Comments.zip archives were built from
+        comments_state_file = finished_folder / ".comments_state.json"
+        comments_state = {}
+        if comments_state_file.is_file():
+            with open(comments_state_file, "r", encoding="utf-8") as file:
+                comments_state = j_load(file)
 
-        with EMailSender(self._storage.email_account, self._storage.my_name) as sender:
+        try:
             for directory in finished_folder.iterdir():
+                if not directory.is_dir():
+                    continue
                 if not (directory / meta_file_name).is_file():
                     self.printer.inform(f"Skipping {directory.name}.")
                     continue
+                if not debug and outbox.state(directory.name) not in (None, PENDING):
+                    continue
 
                 students = list()
                 with open(directory / meta_file_name, 'r') as fp:
@@ -768,43 +1020,122 @@ class WorkflowSendMail(Command):
                     message.append(f"LG {self._storage.my_name_alias}")
                     message = "\n".join(message)
 
-                    shutil.make_archive(directory / "Comments", "zip", directory, "Original and Comments")
+                    # A dry run only lists the mails, an outdated archive is built by the real run
                     archive_zip = directory / "Comments.zip"
+                    comments_fingerprint = directory_fingerprint(directory / "Original and Comments")
+                    archive_outdated = comments_state.get(directory.name) != comments_fingerprint or not archive_zip.is_file()
+                    if archive_outdated and not dry_run:
+                        write_zip(archive_zip, zip_entries(directory / "Original and Comments", directory), ZIP_DEFLATED)
+                        comments_state[directory.name] = comments_fingerprint
+                        archive_outdated = False
+
+                    attachment_size = (feedback_path.stat().st_size + (0 if archive_outdated else archive_zip.stat().st_size)) / 2 ** 20
+                    if attachment_size > attachment_limit:
+                        self.printer.warning(f"The feedback for {directory.name} has {attachment_size:.1f} MiB of attachments, more than {attachment_limit} MiB. The mail server may reject it.")
+
+                    yield directory.name, Mail(
+                        students_as_recipients(students),
+                        message,
+                        f'[IFML-20] Feedback to {self._storage.muesli_data.exercise_prefix} {exercise_number}',
+                        [feedback_path, archive_zip],
+                        debug=debug
+                    )
+        finally:
+            if not dry_run:
+                with open(comments_state_file, "w", encoding="utf-8") as file:
+                    json_save(comments_state, file, indent=4)
+
+
+def parse_mail_flags(args):
+    exercise_numbers = [arg for arg in args if not arg.startswith("--")]
+    flags = {arg.lower() for arg in args if arg.startswith("--")}
+    if len(exercise_numbers) != 1:
+        raise ValueError(f"Expected exactly one exercise number, got {', '.join(exercise_numbers) or 'none'}.")
+    for flag in flags - {"--debug", "--dry-run", "--retry"}:
+        raise ValueError(f'Unexpected flag {flag}')
+    return exercise_numbers[0], flags
+
+
+def send_mails(outbox, mails, storage, printer, flags):
+    # Mails are rendered into the outbox first and the outbox is sent afterwards. Sent and failed mails are
+    # marked there, so a run can be repeated after a crash, and --retry sends only the failed mails again.
+    # Mails of a debug run only go to ourselves and bypass the outbox, a dry run leaves the outbox untouched.
+    if "--debug" in flags:
+        entries = [(key, "debug", mail, None) for key, mail in mails]
+    elif "--retry" in flags:
+        entries = outbox.entries((FAILED,))
+    elif "--dry-run" in flags:
+        entries = [(key, PENDING, mail, None) for key, mail in mails if outbox.state(key) in (None, PENDING)]
+    else:
+        for key, mail in mails:
+            outbox.add(key, mail)
+        entries = outbox.entries((PENDING,))
+
+    if "--dry-run" in flags:
+        header = ["Mail", "State", "Recipients", "Attachments"]
+        columns = [list(), list(), list(), list()]
+        for key, state, mail, error in entries:
+            columns[0].append(key)
+            columns[1].append(state if error is None else f"{state} ({error})")
+            columns[2].append(", ".join(address for _, address in mail.recipients))
+            columns[3].append(", ".join(os.path.basename(path) for path in mail.attachment_files or []))
+        for line in string_table(header, columns, align_row='<'):
+            printer.inform(line)
+        printer.inform(f"Would send {len(entries)} emails.")
+        return
+
+    keys = {id(mail): key for key, _, mail, _ in entries}
+    failures = 0
+    printer.inform(f"Sending {len(entries)} emails ...")
+    try:
+        with DeliveryPool(storage.email_account, storage.my_name, storage.mail_delivery) as pool:
+            for mail, error in pool.deliver(mail for _, _, mail, _ in entries):
+                if error is None:
+                    printer.confirm(f"[Ok]  {mail.label}")
+                else:
+                    failures += 1
+                    printer.error(f"[Err] {mail.label} - {error}")
 
-                    student_names = ', '.join([student.muesli_name for student in students])
-                    self.printer.inform(f"Sending feedback to {student_names} ... ", end='')
-                    try:
-                        sender.send_mail(students, message, f'[IFML-20] Feedback to {self._storage.muesli_data.exercise_prefix} {exercise_number}', [feedback_path, archive_zip], debug=debug)
-                        self.printer.confirm("[Ok]")
-                    except BaseException as e:
-                        self.printer.error(f"[Err] - {e}")
+                if mail.debug:
+                    continue
+                elif error is None:
+                    outbox.mark_sent(keys[id(mail)])
+                else:
+                    outbox.mark_failed(keys[id(mail)], error)
+    except ConnectionSetupError as e:
+        # The mails that were not tried stay pending and are sent by the next run
+        printer.error(f"Stopped sending: {e}. Please check the mail settings in account_data.json.")
+
+    if "--debug" in flags:
+        if failures > 0:
+            printer.error(f"{failures} emails could not be sent.")
+        return
+
+    counts = outbox.count()
+    printer.inform(f"Outbox: {counts[SENT]} sent, {counts[PENDING]} pending, {counts[FAILED]} failed.")
+    if counts[FAILED] > 0:
+        printer.error(f"{counts[FAILED]} emails could not be sent, use --retry to send them again.")
 
 
 class WorkflowSendCrossTask(Command):
     def __init__(self, printer, storage: InteractiveDataStorage):
-        super().__init__(printer, "workflow.send_cross_task", ("w.cross",), 1, 2)
+        super().__init__(printer, "workflow.send_cross_task", ("w.cross",), 1, 3)
         self._storage = storage
 
     def _parse_arguments(self, args):
-        if len(args) == 1:
-            exercise_number = args[0]
-            debug = False
-        else:
-            if args[0].lower() == '--debug':
-                debug = True
-                exercise_number = args[1]
-            else:
-                exercise_number = args[0]
-                debug = args[1].lower() == '--debug'
-
-                if not debug:
-                    raise ValueError(f'Unexpected flag {args[1]}')
+        flags = [arg for arg in args if arg.startswith("--")]
+        numbers = [arg for arg in args if not arg.startswith("--")]
+        for flag in flags:
+            if flag.lower() != '--debug':
+                raise ValueError(f'Unexpected flag {flag}')
+        if len(numbers) == 0 or len(numbers) > 2:
+            raise ValueError("Expected the exercise number and optionally the number of the previous exercise.")
 
-        return exercise_number, debug
+        previous_exercise_number = numbers[1] if len(numbers) == 2 else None
+        return numbers[0], previous_exercise_number, len(flags) > 0
 
     def __call__(self, *args):
-        exercise_number, debug = self. \
-            _parse_arguments(args)
+        exercise_number, previous_exercise_number, debug = self._parse_arguments(args)
         if debug:
             self.printer.confirm("Running in debug mode.")
 
@@ -831,11 +1162,7 @@ class WorkflowSendCrossTask(Command):
             file_path = raw_folder / file_name
             submissions.append((file_path, data["muesli_student_ids"]))
 
-        # Find a permutation without self-assignment
-        while True:
-            new_order = np.random.permutation(len(submissions))
-            if np.all(new_order != np.arange(len(submissions))):
-                break
+        new_order = self._find_assignment(submissions, previous_exercise_number)
 
         with open(assignment_file, "w") as file:
             data = []
@@ -844,7 +1171,7 @@ class WorkflowSendCrossTask(Command):
                 src_file, src_students = submissions[src_idx]
                 tgt_file, tgt_students = submissions[tgt_idx]
 
-                shutil.copyfile(src_file, cross_folder / tgt_file.name)
+                copy_file(src_file, cross_folder / tgt_file.name, self._storage.copy_mode)
 
                 data.append({
                     "submission": src_file.name,
@@ -852,3 +1179,111 @@ class WorkflowSendCrossTask(Command):
                     "assigned_to_muesli_student_ids": tgt_students,
                 })
             json_save(data, file)
+        self.printer.confirm(f"Assigned {len(data)} submissions, see {assignment_file}.")
+
+    def _find_assignment(self, submissions, previous_exercise_number):
+        if len(submissions) < 2:
+            raise ValueError("At least two submissions are needed for cross feedback.")
+
+        tutorials = []
+        for file_path, muesli_ids in submissions:
+            submission_tutorials = set()
+            for muesli_id in muesli_ids:
+                try:
+                    submission_tutorials.add(self._storage.get_student_by_muesli_id(muesli_id).tutorial_id)
+                except ValueError:
+                    self.printer.warning(f"Did not find the student with id {muesli_id} of {file_path.name}, the tutorial constraint ignores them.")
+            tutorials.append(submission_tutorials)
+
+        previous_reviewers = defaultdict(set)
+        if previous_exercise_number is not None:
+            previous_file = Path(self._storage.get_exercise_folder(previous_exercise_number)) / "cross-assignments.json"
+            if previous_file.is_file():
+                previous_reviewers = read_cross_reviewers(previous_file)
+            else:
+                self.printer.warning(f"{previous_file} was not found, last week's assignments are not considered.")
+
+        def reviewed_before(src_idx, tgt_idx):
+            return any(not previous_reviewers[muesli_id].isdisjoint(submissions[tgt_idx][1]) for muesli_id in submissions[src_idx][1])
+
+        def same_tutorial(src_idx, tgt_idx):
+            return not tutorials[src_idx].isdisjoint(tutorials[tgt_idx])
+
+        # The constraints are dropped one by one if no assignment satisfies all of them
+        attempts = [
+            ("", lambda src_idx, tgt_idx: same_tutorial(src_idx, tgt_idx) or reviewed_before(src_idx, tgt_idx)),
+            ("same tutorial", reviewed_before),
+            ("same tutorial, same group as last week", None),
+        ]
+        for dropped, forbidden in attempts:
+            new_order = random_derangement(len(submissions), forbidden)
+            if new_order is not None:
+                if dropped:
+                    self.printer.warning(f"No assignment satisfies all constraints, allowed: {dropped}.")
+                return new_order
+
+
+class WorkflowMergeCrossAssignments(Command):
+    MAX_FILES = 32
+
+    def __init__(self, printer, storage: InteractiveDataStorage):
+        super().__init__(printer, "workflow.merge_cross", ("w.merge",), 2, 1 + WorkflowMergeCrossAssignments.MAX_FILES)
+        self._storage = storage
+
+    def __call__(self, exercise_number, *paths):
+        assignment_file = Path(self._storage.get_exercise_folder(exercise_number)) / "cross-assignments.json"
+        sources = [Path(path) for path in paths]
+        missing = [str(source) for source in sources if not source.is_file()]
+        if len(missing) > 0:
+            raise FileNotFoundError(f"Could not find {', '.join(missing)}")
+        # The own file is part of the merge, so that running it again only adds what is new
+        if assignment_file.is_file() and all(source.resolve() != assignment_file.resolve() for source in sources):
+            sources.insert(0, assignment_file)
+
+        # Every submission is assigned once, the first file that assigns it wins
+        assignments = dict()
+        problems = []
+        for source in sources:
+            added = 0
+            for assignment in read_cross_assignments(source):
+                existing = assignments.get(assignment["submission"])
+                if existing is None:
+                    assignments[assignment["submission"]] = assignment
+                    added += 1
+                elif (set(existing["submission_by_muesli_student_ids"]) != set(assignment["submission_by_muesli_student_ids"])
+                      or set(existing["assigned_to_muesli_student_ids"]) != set(assignment["assigned_to_muesli_student_ids"])):
+                    problems.append(f"{assignment['submission']}: {source} assigns it differently, "
+                                    f"keeping the assignment to {', '.join(map(str, existing['assigned_to_muesli_student_ids']))}")
+            self.printer.inform(f"{source}: {added} new assignment(s)")
+
+        known_muesli_ids = {student.muesli_student_id for student in self._storage.all_students}
+        for assignment in assignments.values():
+            authors = assignment["submission_by_muesli_student_ids"]
+            reviewers = assignment["assigned_to_muesli_student_ids"]
+            unknown = [str(muesli_id) for muesli_id in authors + reviewers if muesli_id not in known_muesli_ids]
+            if len(unknown) > 0:
+                problems.append(f"{assignment['submission']}: unknown MÜSLI ids {', '.join(unknown)}")
+            if len(reviewers) == 0:
+                problems.append(f"{assignment['submission']}: nobody is assigned")
+            elif not set(authors).isdisjoint(reviewers):
+                problems.append(f"{assignment['submission']}: assigned to its own authors")
+
+        if len(problems) > 0:
+            self.printer.warning("The merged assignments have problems:")
+            with self.printer:
+                for problem in problems:
+                    self.printer.warning(problem)
+            if not self.printer.yes_no("Write the merged file anyway?", default="n"):
+                return
+
+        merged = [assignments[submission] for submission in sorted(assignments)]
+        reviewers_by_author = index_cross_assignments(merged)
+        partial_file = assignment_file.with_name(assignment_file.name + ".partial")
+        with open(partial_file, "w") as file:
+            json_save({
+                "assignments": merged,
+                "reviewers_by_author": {str(author): sorted(reviewers) for author, reviewers in sorted(reviewers_by_author.items())}
+            }, file)
+        os.replace(partial_file, assignment_file)
+
+        self.printer.confirm(f"Merged {len(sources)} file(s) into {len(merged)} assignments for {len(reviewers_by_author)} students, see {assignment_file}.")
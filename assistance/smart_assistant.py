@@ -5,10 +5,11 @@ from assistance.command.crossover import ImportCommand, ExportCommand, AssignTut
 from assistance.command.help import HelpCommand
 from assistance.command.info import InfoCommand
 from assistance.command.present import PresentCommand
+from assistance.command.registration import GroupRegistrationCommand
 from assistance.command.stop import StopCommand
 from assistance.command.workflow import WorkflowDownloadCommand, WorkflowParseNamesCommand, WorkflowUnzipCommand, WorkflowPrepareCommand, \
     WorkflowConsolidate, WorkflowUpload, WorkflowSendMail, WorkflowSendCrossTask, WorkflowSendConfirmation, WorkflowSetupEmptyCommand, \
-    WorkflowZipCommand
+    WorkflowZipCommand, WorkflowMergeCrossAssignments
 from assistance.commands import CommandRegister, parse_command, normalize_string
 from data.storage import InteractiveDataStorage
 from moodle.api import MoodleSession
@@ -45,12 +46,14 @@ class SmartAssistant:
         self._command_register.register_command(WorkflowUpload(self._printer, self._storage, self._muesli))
         self._command_register.register_command(WorkflowSendMail(self._printer, self._storage))
         self._command_register.register_command(WorkflowSendCrossTask(self._printer, self._storage))
+        self._command_register.register_command(WorkflowMergeCrossAssignments(self._printer, self._storage))
         self._command_register.register_command(WorkflowZipCommand(self._printer, self._storage))
 
         self._command_register.register_command(ImportCommand(self._printer, self._storage))
         self._command_register.register_command(ExportCommand(self._printer, self._storage))
         self._command_register.register_command(AssignTutorsCommand(self._printer, self._storage))
         self._command_register.register_command(PresentCommand(self._printer, self._storage, self._muesli))
+        self._command_register.register_command(GroupRegistrationCommand(self._printer, self._storage))
 
     def _initialize_connections(self):
         self._print_header("Initializing Connections")
@@ -0,0 +1,93 @@
+import os
+from json import load as j_load
+
+import numpy as np
+
+
+class CreditMatrix:
+    def __init__(self, exercise_number, muesli_ids, credits):
+        self.exercise_number = exercise_number
+        self.muesli_ids = muesli_ids
+        # One row per student, one column per task
+        self.credits = credits
+
+    @property
+    def number_of_students(self):
+        return self.credits.shape[0]
+
+    @property
+    def number_of_tasks(self):
+        return self.credits.shape[1]
+
+    @property
+    def totals(self):
+        return self.credits.sum(axis=1)
+
+    def task_summary(self):
+        return summarize(self.credits)
+
+    def total_summary(self):
+        return summarize(self.totals[:, np.newaxis])[0]
+
+
+def summarize(credits):
+    # One row per column of credits: mean, minimum, lower quartile, median, upper quartile, maximum, zero rate
+    return np.column_stack([
+        credits.mean(axis=0),
+        np.percentile(credits, [0, 25, 50, 75, 100], axis=0).T,
+        (credits == 0).mean(axis=0)
+    ])
+
+
+class CreditStatistics:
+    def __init__(self, storage):
+        self._storage = storage
+        self._cache = dict()
+
+    def load(self, exercise_number):
+        finished_folder = self._storage.get_finished_folder(exercise_number)
+        meta_paths = list()
+        if os.path.isdir(finished_folder):
+            with os.scandir(finished_folder) as entries:
+                for entry in entries:
+                    meta_path = os.path.join(entry.path, "meta.json")
+                    if entry.is_dir() and os.path.isfile(meta_path):
+                        meta_paths.append(meta_path)
+        meta_paths.sort()
+
+        # The matrix is only built again if a meta file was added, removed or changed by w.cons
+        stats = [(path, os.stat(path).st_mtime_ns) for path in meta_paths]
+        cached = self._cache.get(exercise_number)
+        if cached is not None and cached[0] == stats:
+            return cached[1]
+
+        muesli_ids = list()
+        rows = list()
+        for meta_path in meta_paths:
+            with open(meta_path, 'r', encoding='utf-8') as fp:
+                meta = j_load(fp)
+            for muesli_id in meta["muesli_ids"]:
+                muesli_ids.append(muesli_id)
+                rows.append(meta["credits_per_task"])
+
+        number_of_tasks = max((len(row) for row in rows), default=0)
+        if any(len(row) != number_of_tasks for row in rows):
+            raise ValueError(f"The consolidated submissions of exercise {exercise_number} have different numbers of tasks, please run workflow.consolidate {exercise_number} again.")
+
+        matrix = CreditMatrix(exercise_number, muesli_ids, np.array(rows, dtype=float).reshape(len(rows), number_of_tasks))
+        self._cache[exercise_number] = (stats, matrix)
+        return matrix
+
+    def load_all(self):
+        return [self.load(exercise_number) for exercise_number in self._storage.get_exercise_numbers()]
+
+    def running_totals(self, matrices):
+        # Students that did not hand in a sheet get no credits for it
+        muesli_ids = sorted({muesli_id for matrix in matrices for muesli_id in matrix.muesli_ids})
+        rows = {muesli_id: row for row, muesli_id in enumerate(muesli_ids)}
+
+        totals = np.zeros((len(muesli_ids), len(matrices)))
+        for column, matrix in enumerate(matrices):
+            if matrix.number_of_students > 0:
+                totals[[rows[muesli_id] for muesli_id in matrix.muesli_ids], column] = matrix.totals
+        return muesli_ids, np.cumsum(totals, axis=1)
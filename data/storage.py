@@ -9,11 +9,19 @@ from types import SimpleNamespace
 
 from data.data import Student, Tutorial
 from data.student_matching import match_students, print_result_table
+from data.submission_index import SubmissionIndex
 from moodle.api import MoodleSession
 from muesli.api import MuesliSession
 from util.config import load_config, mixin_passwords
 
 
+def exercise_sort_key(exercise_number):
+    # Natural order of sheet names like 2, 10, 01a and 01b: by the leading number, then by the rest
+    digits = len(exercise_number) - len(exercise_number.lstrip("0123456789"))
+    number = int(exercise_number[:digits]) if digits > 0 else -1
+    return number, exercise_number[digits:]
+
+
 def ensure_folder_exists(path):
     if not os.path.exists(path):
         os.makedirs(path)
@@ -26,6 +34,22 @@ class PhysicalDataStorage:
         self._root = os.path.abspath(self._storage_config.root)
         self._meta_path = ensure_folder_exists(p_join(self._root, "__meta__"))
 
+        # Tutor packages of assign-tutors only contain their own files and point to one shared roster snapshot
+        self._shared_meta_path = None
+        pointer_path = p_join(self._meta_path, "shared_meta.json")
+        if os.path.exists(pointer_path):
+            with open(pointer_path, 'r') as fp:
+                self._shared_meta_path = os.path.normpath(p_join(self._root, j_load(fp)["path"]))
+
+    def _meta_file(self, *parts):
+        # Files missing in the own __meta__ are read from the shared roster snapshot, written files always go to __meta__
+        path = p_join(self._meta_path, *parts)
+        if not os.path.exists(path) and self._shared_meta_path is not None:
+            shared_path = p_join(self._shared_meta_path, *parts)
+            if os.path.exists(shared_path):
+                return shared_path
+        return path
+
     def save_my_name(self, my_name):
         path = p_join(self._meta_path, f'01_my_name.json')
         with open(path, 'w') as fp:
@@ -47,7 +71,7 @@ class PhysicalDataStorage:
             j_dump(ids, fp, indent=4)
 
     def load_tutorial_ids(self, mode='my'):
-        path = p_join(self._meta_path, f'02_{mode}_ids.json')
+        path = self._meta_file(f'02_{mode}_ids.json')
         result = list(), "Missing"
         if os.path.exists(path):
             with open(path, 'r') as fp:
@@ -61,7 +85,7 @@ class PhysicalDataStorage:
             j_dump({k: v.to_json() for k, v in tutorials.items()}, fp, indent=4)
 
     def load_tutorial_data(self):
-        path = p_join(self._meta_path, f'03_tutorials.json')
+        path = self._meta_file(f'03_tutorials.json')
         result = dict(), "Missing"
         if os.path.exists(path):
             with open(path, 'r') as fp:
@@ -77,8 +101,8 @@ class PhysicalDataStorage:
             j_dump(out_data, fp, indent=4)
 
     def load_students(self, tutorial_id):
-        directory = ensure_folder_exists(p_join(self._meta_path, "students"))
-        path = p_join(directory, f'students_{tutorial_id}.json')
+        ensure_folder_exists(p_join(self._meta_path, "students"))
+        path = self._meta_file("students", f'students_{tutorial_id}.json')
         result = list(), "Missing"
         if os.path.exists(path):
             with open(path, 'r') as fp:
@@ -117,6 +141,17 @@ class PhysicalDataStorage:
 
         return result
 
+    def load_included_students(self):
+        # The students assigned to this tutor by assign-tutors, None if all students of the own tutorials count
+        path = p_join(self._meta_path, "students", "included_students.json")
+        result = None
+
+        if os.path.exists(path):
+            with open(path, 'r') as fp:
+                result = set(j_load(fp))
+
+        return result
+
     def save_presented_scores(self, presented_score):
         directory = ensure_folder_exists(p_join(self._meta_path, "students"))
         path = p_join(directory, "presented_information.json")
@@ -124,8 +159,8 @@ class PhysicalDataStorage:
             j_dump(presented_score, fp, indent=4)
 
     def load_presented_scores(self):
-        directory = ensure_folder_exists(p_join(self._meta_path, "students"))
-        path = p_join(directory, "presented_information.json")
+        ensure_folder_exists(p_join(self._meta_path, "students"))
+        path = self._meta_file("students", "presented_information.json")
         result = dict(), "Missing"
 
         if os.path.exists(path):
@@ -141,6 +176,21 @@ class PhysicalDataStorage:
 
         return result
 
+    def save_group_registrations(self, registrations):
+        path = p_join(self._meta_path, "group_registrations.json")
+        with open(path, 'w', encoding='utf-8') as fp:
+            j_dump(registrations, fp, indent=4, ensure_ascii=False)
+
+    def load_group_registrations(self):
+        path = p_join(self._meta_path, "group_registrations.json")
+        result = {"uid_validity": None, "last_uid": 0, "registrations": list()}, "Missing"
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as fp:
+                result = j_load(fp), "Loaded"
+
+        return result
+
 
 class InteractiveDataStorage:
     __instance = None
@@ -154,8 +204,10 @@ class InteractiveDataStorage:
         InteractiveDataStorage.__instance.other_tutorial_ids = list()
         InteractiveDataStorage.__instance.tutorials = dict()
         InteractiveDataStorage.__instance.students = dict()
+        InteractiveDataStorage.__instance._muesli_id_index = (None, dict())
         InteractiveDataStorage.__instance.exported_students = list()
         InteractiveDataStorage.__instance.imported_students = list()
+        InteractiveDataStorage.__instance.included_students = None
         InteractiveDataStorage.__instance.scores = dict()
         InteractiveDataStorage.__instance.account_data = mixin_passwords(load_config("account_data.json"))
         InteractiveDataStorage.__instance.config = load_config("config.json")
@@ -177,6 +229,7 @@ class InteractiveDataStorage:
 
         self.__instance.imported_students = self.physical_storage.load_exchanged_students('imported')
         self.__instance.exported_students = self.physical_storage.load_exchanged_students('exported')
+        self.__instance.included_students = self.physical_storage.load_included_students()
 
     def _init_my_name(self, muesli: MuesliSession):
         print(f"Load my name ...", end='')
@@ -378,6 +431,10 @@ class InteractiveDataStorage:
     def storage_config(self):
         return self.config.storage
 
+    @property
+    def copy_mode(self):
+        return getattr(self.storage_config, "copy_mode", "copy")
+
     @property
     def muesli_account(self):
         return self.account_data.muesli
@@ -386,6 +443,10 @@ class InteractiveDataStorage:
     def email_account(self):
         return self.account_data.mail
 
+    @property
+    def mail_delivery(self):
+        return getattr(getattr(self.config, "mail", None), "delivery", None)
+
     @property
     def muesli_data(self):
         return self.config.muesli
@@ -402,10 +463,15 @@ class InteractiveDataStorage:
     def all_students(self):
         return [student for k, students in self.students.items() for student in students]
 
+    def _is_in_my_tutorials(self, student):
+        if self.included_students is not None:
+            return student.muesli_student_id in self.included_students
+        return student.tutorial_id in self.my_tutorial_ids
+
     @property
     def my_students(self):
         return [student for student in self.all_students
-                if (student.tutorial_id in self.my_tutorial_ids
+                if (self._is_in_my_tutorials(student)
                     and student.muesli_student_id not in self.exported_students)
                 or student.muesli_student_id in self.imported_students
                 ]
@@ -413,13 +479,13 @@ class InteractiveDataStorage:
     @property
     def other_students(self):
         return [student for student in self.all_students
-                if student.tutorial_id in self.other_tutorial_ids
+                if not self._is_in_my_tutorials(student)
                 or student.muesli_student_id in self.exported_students]
 
     def list_students(self, tutorial_id):
         if tutorial_id in self.my_tutorial_ids:
             return [student for student in self.all_students
-                    if student.tutorial_id == tutorial_id
+                    if (student.tutorial_id == tutorial_id and self._is_in_my_tutorials(student))
                     or student.muesli_student_id in self.imported_students]
         else:
             return [student for student in self.all_students
@@ -468,12 +534,12 @@ class InteractiveDataStorage:
         return list(result)
 
     def get_student_by_muesli_id(self, muesli_id) -> Student:
-        result = None
-        for student in self.all_students:
-            if student.muesli_student_id == muesli_id:
-                result = student
-                break
+        # The index is built again whenever the lists of students were replaced or changed in length
+        signature = (id(self.students), tuple((tutorial_id, id(students), len(students)) for tutorial_id, students in self.students.items()))
+        if self._muesli_id_index[0] != signature:
+            self._muesli_id_index = (signature, {student.muesli_student_id: student for student in reversed(self.all_students)})
 
+        result = self._muesli_id_index[1].get(muesli_id)
         if result is None:
             location = "(storage.py: get_student_by_muesli_id)"
             raise ValueError(f"There is no student with the MÜSLI-Id {muesli_id} {location}")
@@ -512,6 +578,18 @@ class InteractiveDataStorage:
             f'{self.storage_config.exercise_template}{exercise_number}'
         )
 
+    def get_exercise_numbers(self):
+        submission_root = os.path.join(self.storage_config.root, self.storage_config.submission_root)
+        if not os.path.isdir(submission_root):
+            return list()
+
+        prefix = self.storage_config.exercise_template
+        exercise_numbers = [
+            entry.name[len(prefix):] for entry in os.scandir(submission_root)
+            if entry.is_dir() and entry.name.startswith(prefix) and len(entry.name) > len(prefix)
+        ]
+        return sorted(exercise_numbers, key=exercise_sort_key)
+
     def get_raw_folder(self, exercise_number):
         return os.path.join(
             self.get_exercise_folder(exercise_number),
@@ -542,6 +620,19 @@ class InteractiveDataStorage:
             self.storage_config.cross_folder
         )
 
+    def get_outbox_folder(self, exercise_number, name):
+        return os.path.join(
+            self.get_exercise_folder(exercise_number),
+            "outbox",
+            name
+        )
+
+    def get_submission_index(self, exercise_number):
+        return SubmissionIndex(
+            self.get_preprocessed_folder(exercise_number),
+            os.path.join(self.get_exercise_folder(exercise_number), "submission_index.json")
+        )
+
     def update_exercise_meta(self, muesli, exercise_number):
         tutorial_id = self.my_tutorial_ids[0]
         with muesli:
@@ -566,54 +657,13 @@ class InteractiveDataStorage:
         path = self._get_exercise_meta_path(exercise_number)
         return os.path.exists(path)
 
-    def generate_feedback_template(self, exercise_number, target_path, printer):
+    def load_exercise_meta(self, exercise_number):
         path = self._get_exercise_meta_path(exercise_number)
         if not self.has_exercise_meta(exercise_number):
             raise FileExistsError("The exercise meta data was not created")
 
         with open(path, 'r', encoding='utf-8') as fp:
-            template_data = SimpleNamespace(**j_load(fp))
-
-        with open(os.path.join(target_path, "submission_meta.json"), 'r', encoding='utf-8') as fp:
-            submission_data = SimpleNamespace(**j_load(fp))
-
-        lines = list()
-        lines.append('┌' + '─' * 98 + '┐')
-        lines.append(f'│{template_data.title:^98}│')
-        lines.append('└' + '─' * 98 + '┘')
-        lines.append(f'Handed in as: {submission_data.original_name}')
-        lines.append('')
-
-        if self.muesli_data.feedback.show_problems:
-            if len(submission_data.problems) > 0:
-                lines.append("The following issues occured with the name of the file:")
-                for problem in submission_data.problems:
-                    lines.append("  ■ " + problem)
-                lines.append("Please make sure to correct the issues for the next sheet.")
-                lines.append("")
-            else:
-                lines.append("Great, thanks for naming the file correctly.")
-                lines.append("")
-
-        for task_name, max_credits in template_data.max_credits:
-            max_credits = f'[Max: {max_credits}]'
-
-            lines.append(f'{task_name:<100}'[:-len(max_credits)] + max_credits)
-            lines.append('─' * 100)
-            lines.append(self.muesli_data.feedback.default_answer)
-            lines.append("")
-            lines.append("")
-
-        feedback_path = os.path.join(target_path, f'{self.muesli_data.feedback.file_name}.txt')
-
-        if os.path.exists(feedback_path):
-            printer.warning(f"There is already a generated feedback file at {target_path}."
-                            f" Please remove it manually, if you want to recreate it.")
-
-        else:
-            with open(feedback_path, 'w', encoding='utf-8') as fp:
-                for line in lines:
-                    print(line, file=fp)
+            return SimpleNamespace(**j_load(fp))
 
 
 def replace_special_chars(processed_name):
@@ -627,17 +677,18 @@ def replace_special_chars(processed_name):
     return str(processed_name)
 
 
-def match_student(input_name, list_of_students):
-    def preprocess_name(name):
-        if name is None:
-            return list()
-        else:
-            processed_name = name.lower()
-            processed_name = replace_special_chars(processed_name)
-            processed_name = [part.split('-') for part in processed_name.split()]
-            processed_name = [part for chunk in processed_name for part in chunk]
-            return processed_name
+def preprocess_name(name):
+    if name is None:
+        return list()
+    else:
+        processed_name = name.lower()
+        processed_name = replace_special_chars(processed_name)
+        processed_name = [part.split('-') for part in processed_name.split()]
+        processed_name = [part for chunk in processed_name for part in chunk]
+        return processed_name
 
+
+def match_student(input_name, list_of_students):
     for student in list_of_students:
         if preprocess_name(input_name) == preprocess_name(student.muesli_name):
             return [student]
@@ -646,7 +697,12 @@ def match_student(input_name, list_of_students):
     for student in list_of_students:
         result.append((preprocess_name(student.muesli_name), preprocess_name(student.moodle_name), student))
 
-    for name_part in preprocess_name(input_name):
+    return _filter_by_name_parts(preprocess_name(input_name), result)
+
+
+def _filter_by_name_parts(name_parts, candidates):
+    result = list(candidates)
+    for name_part in name_parts:
         tmp = list(result)
         for muesli_name, moodle_name, student in tmp:
             muesli_index, moodle_index = None, None
@@ -670,3 +726,23 @@ def match_student(input_name, list_of_students):
                 result.remove((muesli_name, moodle_name, student))
 
     return [student for _, _, student in result]
+
+
+class StudentNameIndex:
+    def __init__(self, students):
+        self._exact = dict()
+        self._entries = list()
+        for student in students:
+            muesli_name = preprocess_name(student.muesli_name)
+            self._exact.setdefault(tuple(muesli_name), student)
+            self._entries.append((muesli_name, preprocess_name(student.moodle_name), student))
+
+    def find(self, name):
+        name_parts = preprocess_name(name)
+        if tuple(name_parts) in self._exact:
+            return [self._exact[tuple(name_parts)]]
+
+        # Same semantics as match_student, but students are only normalized once. Matching
+        # consumes name parts, so every query works on fresh copies.
+        candidates = [(list(muesli_name), list(moodle_name), student) for muesli_name, moodle_name, student in self._entries]
+        return _filter_by_name_parts(name_parts, candidates)
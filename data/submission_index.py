@@ -0,0 +1,102 @@
+import os
+from json import load as j_load, dump as j_dump
+from pathlib import Path
+
+
+class SubmissionIndex:
+    def __init__(self, preprocessed_folder, path):
+        self._preprocessed_folder = Path(preprocessed_folder)
+        self._path = Path(path)
+        self._submissions = dict()
+
+        if self._path.is_file():
+            with open(self._path, 'r', encoding='utf-8') as fp:
+                self._submissions = j_load(fp)["submissions"]
+
+        # Only submissions that were added, removed or whose submission_meta.json changed since the last save
+        # need to be read again
+        if self._preprocessed_folder.is_dir() and self._synchronize():
+            self.save()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def names(self):
+        return list(self._submissions.keys())
+
+    def __len__(self):
+        return len(self._submissions)
+
+    def __contains__(self, name):
+        return name in self._submissions
+
+    def folder(self, name):
+        return self._preprocessed_folder / name
+
+    def meta(self, name):
+        return self._submissions[name]["meta"]
+
+    def files(self, name):
+        return self._submissions[name]["files"]
+
+    def size(self, name):
+        return sum(size for _, size, _ in self.files(name))
+
+    def items(self):
+        return [(self.folder(name), entry["meta"]) for name, entry in self._submissions.items()]
+
+    def by_muesli_id(self):
+        result = dict()
+        for name, entry in self._submissions.items():
+            for muesli_id in entry["meta"]["muesli_student_ids"]:
+                result[muesli_id] = self.folder(name)
+        return result
+
+    def update(self, name, meta=None):
+        folder = self.folder(name)
+        meta_path = folder / "submission_meta.json"
+        if meta is None:
+            with open(meta_path, 'r', encoding='utf-8') as fp:
+                meta = j_load(fp)
+        meta_stat = os.stat(meta_path)
+
+        files = list()
+        for root, directories, file_names in os.walk(folder):
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                stat = os.stat(path)
+                files.append([os.path.relpath(path, folder), stat.st_size, stat.st_mtime])
+        files.sort()
+
+        self._submissions[name] = {"meta": meta, "files": files, "meta_stat": _stat_signature(meta_stat)}
+
+    def remove(self, name):
+        self._submissions.pop(name, None)
+
+    def save(self):
+        with open(self._path, 'w', encoding='utf-8') as fp:
+            j_dump({"submissions": self._submissions}, fp)
+
+    def _synchronize(self):
+        on_disk = dict()
+        for entry in os.scandir(self._preprocessed_folder):
+            if entry.is_dir() and not entry.name.startswith("."):
+                try:
+                    on_disk[entry.name] = _stat_signature(os.stat(os.path.join(entry.path, "submission_meta.json")))
+                except FileNotFoundError:
+                    pass
+
+        indexed = set(self._submissions.keys())
+        changed = {name for name in indexed & on_disk.keys() if self._submissions[name].get("meta_stat") != on_disk[name]}
+        for name in indexed - on_disk.keys():
+            self.remove(name)
+        for name in (on_disk.keys() - indexed) | changed:
+            self.update(name)
+
+        return on_disk.keys() != indexed or len(changed) > 0
+
+
+def _stat_signature(stat):
+    return [stat.st_size, stat.st_mtime_ns]
@@ -0,0 +1,159 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Empty, Queue
+from smtplib import SMTPAuthenticationError, SMTPRecipientsRefused, SMTPResponseException
+
+from mail.mail_out import EMailSender
+
+
+class ConnectionSetupError(Exception):
+    # Connecting or logging in failed, e.g. because of a wrong host or password. Retrying does not help.
+    pass
+
+
+class Mail:
+    def __init__(self, recipients, message, subject, attachment_files=None, debug=False, label=None):
+        # recipients: (name, address) pairs
+        self.recipients = recipients
+        self.message = message
+        self.subject = subject
+        self.attachment_files = attachment_files
+        self.debug = debug
+        self.label = label if label is not None else ", ".join(name for name, _ in recipients)
+
+
+def students_as_recipients(students):
+    return [(student.muesli_name, student.muesli_mail) for student in students]
+
+
+def is_temporary_failure(error):
+    # 4xx replies and dropped connections are worth another try, rejected recipients, 5xx replies,
+    # failed logins and missing attachments are not
+    if isinstance(error, (ConnectionSetupError, SMTPAuthenticationError, FileNotFoundError, IsADirectoryError, PermissionError)):
+        return False
+    if isinstance(error, SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, SMTPRecipientsRefused):
+        return False
+    return isinstance(error, OSError)
+
+
+class RateLimiter:
+    def __init__(self, messages_per_minute=None):
+        self._interval = 60.0 / messages_per_minute if messages_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self._interval == 0.0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class DeliveryPool:
+    def __init__(self, mail_account, my_name, config=None):
+        self._mail_account = mail_account
+        self._my_name = my_name
+
+        self.connections = max(1, getattr(config, "connections", 3))
+        self.max_retries = getattr(config, "max_retries", 3)
+        self.retry_delay = getattr(config, "retry_delay", 2.0)
+        self._rate_limiter = RateLimiter(getattr(config, "messages_per_minute", None))
+
+        self._senders = Queue()
+        self._created_senders = list()
+        self._lock = threading.Lock()
+        self._setup_error = None
+        self._connected_once = False
+
+    def __enter__(self):
+        # Senders ask for the password when they are created, this must not happen in the worker threads
+        self._senders.put(self._create_sender())
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for sender in self._created_senders:
+            sender.close()
+        self._created_senders.clear()
+        self._senders = Queue()
+
+    def deliver(self, mails):
+        # Yields (mail, error) in the order the mails were delivered, error is None on success.
+        # If no connection can be set up, the remaining mails are not tried and ConnectionSetupError is raised
+        # once the mails in flight are done. Mails that were not tried are not yielded.
+        mails = list(mails)
+        if len(mails) == 0:
+            return
+
+        self._setup_error = None
+        with ThreadPoolExecutor(max_workers=min(self.connections, len(mails))) as executor:
+            futures = {executor.submit(self._deliver, mail): mail for mail in mails}
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                error = future.exception()
+                if isinstance(error, ConnectionSetupError):
+                    for pending in futures:
+                        pending.cancel()
+                    continue
+                yield futures[future], error
+
+        if self._setup_error is not None:
+            raise self._setup_error
+
+    def _deliver(self, mail):
+        sender = self._acquire_sender()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    if not sender.connected:
+                        self._connect(sender)
+                    self._rate_limiter.wait()
+                    sender.send_to(mail.recipients, mail.message, mail.subject, mail.attachment_files, mail.debug)
+                    return
+                except Exception as e:
+                    if attempt == self.max_retries or not is_temporary_failure(e):
+                        raise
+                    # Start over with a fresh connection, the old one may be broken
+                    sender.close()
+                    time.sleep(self.retry_delay * 2 ** attempt)
+        finally:
+            self._senders.put(sender)
+
+    def _connect(self, sender):
+        # Only a failed first connection or login stops the whole run, a failed reconnect is retried like
+        # any other temporary failure of the mail
+        if self._setup_error is not None:
+            raise self._setup_error
+        try:
+            sender.connect()
+        except Exception as e:
+            sender.close()
+            if self._connected_once and not isinstance(e, SMTPAuthenticationError):
+                raise
+            self._setup_error = ConnectionSetupError(f"Could not connect to the mail server: {e}")
+            raise self._setup_error from e
+        self._connected_once = True
+
+    def _acquire_sender(self):
+        try:
+            return self._senders.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            if len(self._created_senders) < self.connections:
+                return self._create_sender()
+        return self._senders.get()
+
+    def _create_sender(self):
+        sender = EMailSender(self._mail_account, self._my_name)
+        self._created_senders.append(sender)
+        return sender
@@ -0,0 +1,82 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from mail.delivery import DeliveryPool, Mail
+from mail.smtp_sink import SMTPSink
+from util.console import string_table
+
+
+# Sends a synthetic sheet of feedback mails to the local SMTP sink and reports the throughput,
+# run it from the project root: python -m mail.delivery_benchmark
+def synthetic_sheet(folder, groups, attachment_size):
+    mails = list()
+    for group in range(groups):
+        feedback_path = os.path.join(folder, f"Feedback_{group}.txt")
+        with open(feedback_path, 'w', encoding='utf-8') as fp:
+            fp.write(f"Aufgabe {group}\n" + "Kein Kommentar - also war wohl alles richtig.\n" * 40)
+
+        archive_path = os.path.join(folder, f"Comments_{group}.zip")
+        with open(archive_path, 'wb') as fp:
+            fp.write(os.urandom(attachment_size))
+
+        recipients = [(f"Student {group}-{i}", f"student{group}.{i}@localhost") for i in range(3)]
+        mails.append(Mail(recipients, "This feedback is for:\n...", f"Feedback zu Übung {group}", [feedback_path, archive_path]))
+
+    # This mail must fail on its own, without breaking the connection for the mails after it
+    missing_path = os.path.join(folder, "Missing.zip")
+    mails.insert(len(mails) // 2, Mail([("Student", "student@localhost")], "...", "Feedback ohne Anhang", [missing_path]))
+    return mails, 1
+
+
+def benchmark(mails, port, connections):
+    mail_account = SimpleNamespace(
+        user=None,
+        password=None,
+        address="tutor@localhost",
+        mail_server=SimpleNamespace(outgoing=SimpleNamespace(host="localhost", port=port, starttls=False, login=False))
+    )
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with DeliveryPool(mail_account, "Tutor", SimpleNamespace(connections=connections)) as pool:
+        failures = sum(1 for _, error in pool.deliver(mails) if error is not None)
+    duration = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration, peak_memory, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the mail delivery against a local SMTP sink.")
+    parser.add_argument("--groups", type=int, default=100, help="number of feedback mails")
+    parser.add_argument("--attachment-size", type=int, default=512, help="size of Comments.zip in KiB")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 3, 6])
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder, SMTPSink(port=0) as sink:
+        mails, expected_failures = synthetic_sheet(folder, arguments.groups, arguments.attachment_size * 1024)
+
+        columns = [list(), list(), list(), list(), list()]
+        for connections in arguments.connections:
+            duration, peak_memory, failures = benchmark(mails, sink.port, connections)
+            columns[0].append(connections)
+            columns[1].append(f"{duration:.2f}")
+            columns[2].append(f"{len(mails) / duration:.1f}")
+            columns[3].append(f"{peak_memory / 2 ** 20:.1f}")
+            columns[4].append(failures)
+
+        print(f"{arguments.groups} mails with {arguments.attachment_size} KiB attachment each")
+        for line in string_table(["Connections", "Seconds", "Mails/s", "Peak MiB", "Failures"], columns):
+            print(line)
+        if any(failures != expected_failures for failures in columns[4]):
+            print(f"Expected exactly {expected_failures} failure(s) for the mail with a missing attachment.")
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import codecs
+import imaplib
+import re
+from email import message_from_bytes
+from email.header import decode_header
+from email.utils import parseaddr
+from socket import gaierror
+
+from util.collection import group
+
+HEADER_FIELDS = "FROM SUBJECT DATE"
+TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+
+def decode_header_value(value):
+    if value is None:
+        return ""
+
+    parts = decode_header(value)
+    result = list()
+    for part, encoding in parts:
+        if encoding is not None:
+            part = part.decode(encoding, errors='ignore')
+        if type(part) is bytes:
+            part = part.decode(errors='ignore')
+        part = part.replace("\r\n", "").replace("\t", " ")
+        result.append(part)
+
+    return "".join(result)
+
+
+class EMailReceiver:
+    def __init__(self, mail_account):
+        self._email_user = mail_account.user
+        self._email_password = str(mail_account.password)
+
+        self._host = mail_account.mail_server.incoming.host
+        self._port = mail_account.mail_server.incoming.port
+
+        self._imap_server = None
+
+    def __enter__(self):
+        try:
+            self._imap_server = imaplib.IMAP4_SSL(self._host, int(self._port))
+        except gaierror:
+            raise ConnectionRefusedError(f"Host '{self._host}:{self._port}' was not found.")
+
+        self._imap_server.login(self._email_user, self._email_password)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._imap_server.logout()
+
+    def select(self, folder="Inbox"):
+        # Returns the UIDVALIDITY of the folder, UIDs are only comparable as long as it does not change
+        code, _ = self._imap_server.select(folder, readonly=True)
+        if code != "OK":
+            raise ConnectionError(f"Could not open the mail folder '{folder}'.")
+        _, data = self._imap_server.response("UIDVALIDITY")
+        return int(data[0])
+
+    def search_new(self, subject, last_uid=0):
+        if subject.isascii():
+            code, data = self._imap_server.uid("SEARCH", None, "UID", f"{last_uid + 1}:*", "SUBJECT", f'"{subject}"')
+        else:
+            self._imap_server.literal = subject.encode("utf-8")
+            code, data = self._imap_server.uid("SEARCH", "CHARSET", "UTF-8", "UID", f"{last_uid + 1}:*", "SUBJECT")
+        if code != "OK":
+            raise ConnectionError(f"Searching for '{subject}' failed.")
+
+        # n:* always contains the newest mail, even if its UID is smaller than n
+        return sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+
+    def fetch_first_text_parts(self, uids):
+        # Only the headers and the first text/plain part of every mail are transferred, never attachments
+        if len(uids) == 0:
+            return dict()
+
+        headers = self._fetch(uids, f"BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})]")
+
+        # The body structure tells where the first text/plain part is and how it is encoded
+        sections = dict()
+        for uid, structure in self._fetch_body_structures(uids).items():
+            text_part = _find_plain_text(structure)
+            if text_part is not None:
+                sections[uid] = text_part
+
+        texts = dict()
+        for section, section_uids in group(sections, key=lambda uid: sections[uid][0]).items():
+            for uid, body in self._fetch(section_uids, f"BODY.PEEK[{section}]").items():
+                _, charset, encoding = sections[uid]
+                part = message_from_bytes(f"Content-Type: text/plain; charset=\"{charset}\"\r\nContent-Transfer-Encoding: {encoding}\r\n\r\n".encode() + body)
+                payload = part.get_payload(decode=True) or b""
+                texts[uid] = payload.decode(charset, errors="ignore").strip()
+
+        result = dict()
+        for uid, header in headers.items():
+            message = message_from_bytes(header)
+            result[uid] = {
+                "uid": uid,
+                "date": message["Date"],
+                "from": decode_header_value(message["From"]),
+                "from_mail": parseaddr(decode_header_value(message["From"]))[1],
+                "subject": decode_header_value(message["Subject"]),
+                "content": texts.get(uid, "")
+            }
+        return result
+
+    def _fetch_body_structures(self, uids):
+        code, data = self._imap_server.uid("FETCH", ",".join(map(str, uids)), "(UID BODYSTRUCTURE)")
+        if code != "OK":
+            raise ConnectionError("Fetching BODYSTRUCTURE failed.")
+
+        # imaplib splits off literals like {5}, they are put back as quoted strings
+        pieces = list()
+        for entry in data:
+            if isinstance(entry, tuple):
+                pieces.append(re.sub(rb"\{\d+\}$", b"", entry[0]))
+                pieces.append(b'"' + entry[1].replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"')
+            elif entry is not None:
+                pieces.append(entry)
+
+        result = dict()
+        tokens = iter(TOKEN.findall(b" ".join(pieces)))
+        uid = None
+        for token in tokens:
+            if token == b"UID":
+                uid = int(next(tokens))
+            elif token == b"BODYSTRUCTURE" and uid is not None:
+                result[uid] = _parse_list(tokens, next(tokens))
+                uid = None
+        return result
+
+    def _fetch(self, uids, item):
+        code, data = self._imap_server.uid("FETCH", ",".join(map(str, uids)), f"(UID {item})")
+        if code != "OK":
+            raise ConnectionError(f"Fetching {item} failed.")
+
+        result = dict()
+        for entry in data:
+            if isinstance(entry, tuple):
+                matcher = re.search(rb"UID (\d+)", entry[0])
+                if matcher is not None:
+                    result[int(matcher.group(1))] = entry[1]
+        return result
+
+
+def _parse_list(tokens, token):
+    # Turns the tokens of a BODYSTRUCTURE into nested lists of strings, NIL becomes None
+    if token == b"(":
+        result = list()
+        for token in tokens:
+            if token == b")":
+                return result
+            result.append(_parse_list(tokens, token))
+        return result
+    if token.startswith(b'"'):
+        return re.sub(rb"\\(.)", rb"\1", token[1:-1]).decode(errors="ignore")
+    if token.upper() == b"NIL":
+        return None
+    return token.decode(errors="ignore")
+
+
+def _find_plain_text(structure, section=""):
+    # (section, charset, transfer encoding) of the first text/plain part, None if there is none
+    if len(structure) > 0 and isinstance(structure[0], list):
+        # A multipart lists its parts first, followed by the subtype and extension data
+        for number, part in enumerate(structure, start=1):
+            if not isinstance(part, list):
+                break
+            result = _find_plain_text(part, f"{section}.{number}" if section else str(number))
+            if result is not None:
+                return result
+        return None
+
+    if len(structure) < 6 or str(structure[0]).lower() != "text" or str(structure[1]).lower() != "plain":
+        return None
+    parameters = structure[2] if isinstance(structure[2], list) else []
+    charset = "utf-8"
+    for key, value in zip(parameters[::2], parameters[1::2]):
+        if str(key).lower() == "charset" and value:
+            charset = value
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = "utf-8"
+    return section or "TEXT", charset, (structure[5] or "7bit").lower()
@@ -1,85 +1,201 @@
+import re
+import uuid
 from _socket import gaierror
-from email.encoders import encode_base64
+from base64 import encodebytes
+from contextlib import ExitStack
 from email.header import Header
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from os.path import basename
-from smtplib import SMTP
+from smtplib import SMTP, SMTPDataError, SMTPException, SMTPRecipientsRefused, SMTPSenderRefused
+
+# A multiple of 57 bytes, which base64 encodes into full lines of 76 characters
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
 
 
 class EMailSender:
     def __init__(self, mail_account, my_name):
-        self._email_user = mail_account.user
-        self._email_password = str(mail_account.password)
-        self._my_mail = mail_account.address
-
         self._host = mail_account.mail_server.outgoing.host
         self._port = mail_account.mail_server.outgoing.port
+        # Both can be switched off for a local server like mail/smtp_sink.py
+        self._starttls = getattr(mail_account.mail_server.outgoing, "starttls", True)
+        self._login = getattr(mail_account.mail_server.outgoing, "login", True)
+
+        self._email_user = mail_account.user
+        self._email_password = str(mail_account.password) if self._login else None
+        self._my_mail = mail_account.address
 
         self._my_name = my_name
         self._smtp_server = None
 
     def __enter__(self):
+        self.connect()
+        return self
+
+    def connect(self):
         try:
             self._smtp_server = SMTP(self._host, self._port)
         except gaierror:
             raise ConnectionRefusedError(f"Host '{self._host}:{self._port}' was not found.")
 
-        self._smtp_server.starttls()
+        if self._starttls:
+            self._smtp_server.starttls()
         # self._smtp_server.set_debuglevel(1)
 
-        code, resp = self._smtp_server.login(self._email_user, self._email_password)
-        if code not in (235, 503):
-            raise ConnectionError("Could not log in to SMTP mail server. Please check account_data.json")
+        if self._login:
+            code, resp = self._smtp_server.login(self._email_user, self._email_password)
+            if code not in (235, 503):
+                raise ConnectionError("Could not log in to SMTP mail server. Please check account_data.json")
 
-        return self
+    @property
+    def connected(self):
+        return self._smtp_server is not None
+
+    def close(self):
+        if self._smtp_server is None:
+            return
+        try:
+            self._smtp_server.quit()
+        except (SMTPException, OSError):
+            # The server already dropped the connection
+            self._smtp_server.close()
+        finally:
+            self._smtp_server = None
 
     def send_mail(self, students, message, subject, attachment_files=None, debug=False):
+        recipients = [(student.muesli_name, student.muesli_mail) for student in students]
+        self.send_to(recipients, message, subject, attachment_files, debug)
+
+    def send_to(self, recipients, message, subject, attachment_files=None, debug=False):
         def normalize_mail(name, mail):
             name = Header(f'{name}'.encode('utf-8'), 'utf-8').encode()
             return f'{name} <{mail}>'
 
         from_email = normalize_mail(self._my_name, self._my_mail)
 
-        to_emails = [normalize_mail(student.muesli_name, student.muesli_mail) for student in students]
+        to_emails = [normalize_mail(name, mail) for name, mail in recipients]
 
         email_message = MIMEMultipart()
         email_message.add_header('From', from_email)
         email_message.add_header('To', ', '.join(to_emails))
         email_message.add_header('CC', from_email)
-        email_message.add_header('Subject', subject)
+        email_message.add_header('Subject', Header(subject, 'utf-8').encode())
 
         text_part = MIMEText(message, 'plain')
         email_message.attach(text_part)
 
-        if attachment_files is not None:
-            for attachment_file in attachment_files if isinstance(attachment_files, list) else [attachment_files]:
-                attachment = create_file_attachment(attachment_file)
-                email_message.attach(attachment)
+        if attachment_files is None:
+            attachment_files = list()
+        elif not isinstance(attachment_files, list):
+            attachment_files = [attachment_files]
+        placeholders = list()
+        for attachment_file in attachment_files:
+            placeholders.append(f"attachment-{uuid.uuid4().hex}")
+            email_message.attach(create_file_attachment(attachment_file, placeholders[-1]))
 
         if debug:
             to_emails = [from_email]
         else:
             to_emails = to_emails + [from_email]
 
-        self._smtp_server.sendmail(
-            from_addr=from_email,
-            to_addrs=to_emails,
-            msg=email_message.as_bytes()
-        )
+        # Everything that can fail is done before DATA, afterwards a failure would leave the session inside DATA
+        segments = message_segments(email_message, placeholders)
+        with ExitStack() as stack:
+            attachments = [stack.enter_context(open(attachment_file, 'rb')) for attachment_file in attachment_files]
+            self._send_chunks(from_email, to_emails, message_chunks(segments, attachments))
+
+    def _send_chunks(self, from_addr, to_addrs, chunks):
+        # Like SMTP.sendmail, but the message is written to the connection piece by piece
+        # instead of being built in memory as a whole
+        server = self._smtp_server
+        server.ehlo_or_helo_if_needed()
+
+        code, response = server.mail(from_addr)
+        if code != 250:
+            server.rset()
+            raise SMTPSenderRefused(code, response, from_addr)
+
+        refused = dict()
+        for address in to_addrs:
+            code, response = server.rcpt(address)
+            if code not in (250, 251):
+                refused[address] = (code, response)
+        if len(refused) == len(to_addrs):
+            server.rset()
+            raise SMTPRecipientsRefused(refused)
+
+        code, response = server.docmd("data")
+        if code != 354:
+            server.rset()
+            raise SMTPDataError(code, response)
+
+        try:
+            last_chunk = b"\r\n"
+            for chunk in chunks:
+                if len(chunk) > 0:
+                    server.send(chunk)
+                    last_chunk = chunk
+            server.send(b".\r\n" if last_chunk.endswith(b"\r\n") else b"\r\n.\r\n")
+
+            code, response = server.getreply()
+        except BaseException:
+            # The server would read the next commands as message data, so the connection is dropped without QUIT
+            server.close()
+            self._smtp_server = None
+            raise
+        if code != 250:
+            raise SMTPDataError(code, response)
+        return refused
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._smtp_server.quit()
+        self.close()
 
 
-def create_file_attachment(feedback_path):
+def create_file_attachment(feedback_path, placeholder):
+    # The content is not read here, message_chunks streams it from disk in place of the placeholder
     file_name = basename(feedback_path)
 
     attachment = MIMEBase("application", "octet-stream")
-    with open(feedback_path, 'rb') as fp:
-        attachment.set_payload(fp.read())
-    encode_base64(attachment)
-    attachment.add_header("Content-Disposition", f"attachment; filename={file_name}")
+    attachment.set_payload(placeholder)
+    attachment.add_header("Content-Transfer-Encoding", "base64")
+    attachment.add_header("Content-Disposition", "attachment", filename=file_name)
 
     return attachment
+
+
+def message_segments(email_message, placeholders):
+    # Everything except the attachments is small, it is dot-stuffed for the DATA command as a whole.
+    # Serialized like SMTP.send_message with the compat32 policy of the message, only the line endings become CRLF.
+    data = re.sub(br'\r?\n', b'\r\n', email_message.as_bytes())
+    data = re.sub(br'(?m)^\.', b'..', data)
+    segments = list()
+    for placeholder in placeholders:
+        before, data = data.split(placeholder.encode('ascii'), 1)
+        segments.append(before)
+    segments.append(data)
+    return segments
+
+
+def message_chunks(segments, attachments):
+    # The attachments are streamed in between the segments of the message
+    for segment, attachment in zip(segments, attachments):
+        yield segment
+        yield from encode_file(attachment)
+    yield segments[-1]
+
+
+def encode_file(fp):
+    # Base64 lines never start with a dot, so they need no dot-stuffing
+    previous = None
+    while True:
+        chunk = fp.read(ATTACHMENT_CHUNK_SIZE)
+        if len(chunk) == 0:
+            break
+        if previous is not None:
+            yield previous
+        previous = encodebytes(chunk).replace(b"\n", b"\r\n")
+
+    # The line break before the next boundary belongs to the boundary
+    if previous is not None:
+        yield previous[:-2]
@@ -0,0 +1,118 @@
+import os
+from json import load as j_load, dump as j_dump
+from pathlib import Path
+
+from mail.delivery import Mail
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class Outbox:
+    # One json file per mail, which also records whether the mail was sent. A run that was interrupted
+    # can therefore be resumed without sending any mail twice.
+    def __init__(self, folder):
+        self._folder = Path(folder)
+        # States of all mails, read once so that rendering does not open a file per mail
+        self._states = None
+
+    @property
+    def folder(self):
+        return self._folder
+
+    def state(self, key):
+        return self._get_states().get(key)
+
+    def add(self, key, mail: Mail):
+        # Only mails that were never tried may be replaced, e.g. by a newer rendering
+        if self.state(key) not in (None, PENDING):
+            return False
+
+        self._save(key, {"state": PENDING, "error": None, "mail": mail_to_json(mail)})
+        return True
+
+    def entries(self, states=None):
+        result = list()
+        for key, state in sorted(self._get_states().items()):
+            if states is None or state in states:
+                entry = self._load(key)
+                result.append((key, entry["state"], mail_from_json(entry["mail"]), entry["error"]))
+        return result
+
+    def count(self):
+        counts = {PENDING: 0, SENT: 0, FAILED: 0}
+        for state in self._get_states().values():
+            counts[state] += 1
+        return counts
+
+    def _get_states(self):
+        if self._states is None:
+            self._states = dict()
+            if self._folder.is_dir():
+                with os.scandir(self._folder) as files:
+                    for file in files:
+                        if file.name.endswith(".json"):
+                            key = file.name[:-len(".json")]
+                            self._states[key] = self._load(key)["state"]
+        return self._states
+
+    def mark_sent(self, key):
+        self._set_state(key, SENT, None)
+
+    def mark_failed(self, key, error):
+        self._set_state(key, FAILED, str(error))
+
+    def _set_state(self, key, state, error):
+        entry = self._load(key)
+        entry["state"] = state
+        entry["error"] = error
+        self._save(key, entry)
+
+    def _path(self, key):
+        return self._folder / f"{key}.json"
+
+    def _load(self, key):
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        with open(path, 'r', encoding='utf-8') as fp:
+            return j_load(fp)
+
+    def _save(self, key, entry):
+        # Written to a temporary file first, so that a crash never leaves a broken entry
+        self._folder.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        partial_path = path.with_name(path.name + ".partial")
+        with open(partial_path, 'w', encoding='utf-8') as fp:
+            j_dump(entry, fp, indent=4)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(partial_path, path)
+        self._get_states()[key] = entry["state"]
+
+
+def mail_to_json(mail: Mail):
+    attachment_files = mail.attachment_files
+    if attachment_files is not None and not isinstance(attachment_files, list):
+        attachment_files = [attachment_files]
+
+    return {
+        "recipients": [list(recipient) for recipient in mail.recipients],
+        "message": mail.message,
+        "subject": mail.subject,
+        "attachment_files": None if attachment_files is None else [str(path) for path in attachment_files],
+        "debug": mail.debug,
+        "label": mail.label
+    }
+
+
+def mail_from_json(dictionary):
+    return Mail(
+        [tuple(recipient) for recipient in dictionary["recipients"]],
+        dictionary["message"],
+        dictionary["subject"],
+        dictionary["attachment_files"],
+        dictionary["debug"],
+        dictionary["label"]
+    )
@@ -1,4 +1,5 @@
 import os
+import sys
 from email.encoders import encode_base64
 from email.mime.multipart import MIMEMultipart, MIMEBase
 from email.mime.text import MIMEText
@@ -8,13 +9,15 @@ import util.config
 
 mail_account = util.config.load_config("../account_data.json").mail
 
-my_name = "Christopher Schuster"
+# Usage: python send_demo.py <file to attach> [<recipient address> ...], without recipients the mail goes to yourself
+attachment_path = sys.argv[1]
+my_name = "Tutorial Smart Assistant"
 email_user = mail_account.user
 email_password = mail_account.password
 my_mail = mail_account.address
 
 from_email = f'{my_name} <{my_mail}>'  # or simply the email address
-to_emails = ['A <christopher.schuster@t-online.de>', 'B <schustrchr@gmail.com>']
+to_emails = sys.argv[2:] if len(sys.argv) > 2 else [from_email]
 
 # Create multipart MIME email
 email_message = MIMEMultipart()
@@ -28,20 +31,23 @@ text_part = MIMEText('Hello world plain text!', 'plain')
 
 # Create file attachment
 attachment = MIMEBase("application", "octet-stream")
-with open(os.path.join("E:", "envir_new.yml"), 'rb') as fp:
+with open(attachment_path, 'rb') as fp:
     attachment.set_payload(fp.read())  # Raw attachment data
 encode_base64(attachment)
-attachment.add_header("Content-Disposition", "attachment; filename=envir_new.yml")
+attachment.add_header("Content-Disposition", f"attachment; filename={os.path.basename(attachment_path)}")
 
 # Attach all the parts to the Multipart MIME email
 email_message.attach(text_part)
 email_message.attach(attachment)
 
 # Connect, authenticate, and send mail
-smtp_server = SMTP(mail_account.mail_server.outgoing.host, port=mail_account.mail_server.outgoing.port)
+outgoing = mail_account.mail_server.outgoing
+smtp_server = SMTP(outgoing.host, port=outgoing.port)
 smtp_server.set_debuglevel(1)  # Show SMTP server interactions
-smtp_server.starttls()
-smtp_server.login(email_user, email_password)
+if getattr(outgoing, "starttls", True):
+    smtp_server.starttls()
+if getattr(outgoing, "login", True):
+    smtp_server.login(email_user, email_password)
 to_emails = to_emails + [from_email]
 smtp_server.sendmail(from_email, to_emails, email_message.as_bytes())
 
@@ -0,0 +1,113 @@
+import argparse
+import os
+import socketserver
+import threading
+import time
+
+
+# A minimal SMTP server which accepts every mail and either stores it as .eml file or only counts it.
+# Point mail.mail_server.outgoing in account_data.json to it (with "starttls": false and "login": false)
+# to try the mail commands without sending anything to students.
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="localhost", port=2525, folder=None):
+        super().__init__((host, port), _SMTPHandler)
+        self.folder = folder
+        self.received = 0
+        self.received_bytes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+        if self.folder is not None:
+            os.makedirs(self.folder, exist_ok=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def store(self, sender, recipients, data):
+        with self._lock:
+            self.received += 1
+            self.received_bytes += len(data)
+            number = self.received
+
+        if self.folder is not None:
+            with open(os.path.join(self.folder, f"{number:05d}.eml"), 'wb') as fp:
+                fp.write(data)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self._reply(220, "localhost SMTP sink ready")
+        sender, recipients = None, list()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', errors='replace').strip()
+            verb = command[:4].upper()
+
+            if verb == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-8BITMIME\r\n250 SIZE 0\r\n")
+            elif verb == "HELO":
+                self._reply(250, "localhost")
+            elif verb == "MAIL":
+                sender, recipients = command[10:].strip(), list()
+                self._reply(250, "OK")
+            elif verb == "RCPT":
+                recipients.append(command[8:].strip())
+                self._reply(250, "OK")
+            elif verb == "DATA":
+                self._reply(354, "End data with <CR><LF>.<CR><LF>")
+                self.server.store(sender, recipients, self._read_data())
+                self._reply(250, "OK")
+            elif verb == "RSET":
+                sender, recipients = None, list()
+                self._reply(250, "OK")
+            elif verb == "NOOP":
+                self._reply(250, "OK")
+            elif verb == "QUIT":
+                self._reply(221, "Bye")
+                return
+            else:
+                self._reply(502, "Command not implemented")
+
+    def _read_data(self):
+        lines = list()
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b".\r\n":
+                return b"".join(lines)
+            # Undo the dot stuffing of the client
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+    def _reply(self, code, message):
+        self.wfile.write(f"{code} {message}\r\n".encode('ascii'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local SMTP server which accepts every mail without delivering it.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--folder", default=None, help="store the received mails as .eml files in this folder")
+    arguments = parser.parse_args()
+
+    with SMTPSink(arguments.host, arguments.port, arguments.folder) as sink:
+        print(f"Listening on {arguments.host}:{sink.port}, press Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(f"Received {sink.received} mails.")
@@ -0,0 +1,77 @@
+import heapq
+import random
+from collections import deque
+
+
+def random_derangement(count, forbidden=None, rng=random):
+    # Returns order with order[i] != i and not forbidden(i, order[i]) for every i, or None if there is none.
+    # This is a perfect matching with shuffled candidates, found with at most count augmenting path searches.
+    candidates = list()
+    for source in range(count):
+        targets = [target for target in range(count) if target != source and (forbidden is None or not forbidden(source, target))]
+        rng.shuffle(targets)
+        candidates.append(targets)
+
+    source_of = [None] * count
+    target_of = [None] * count
+    sources = list(range(count))
+    rng.shuffle(sources)
+    for source in sources:
+        if not _augment(source, candidates, source_of, target_of):
+            return None
+    return target_of
+
+
+def _augment(start, candidates, source_of, target_of):
+    # Breadth first search for an alternating path from start to a free target, which is then flipped
+    previous = dict()
+    queue = deque([start])
+    while len(queue) > 0:
+        source = queue.popleft()
+        for target in candidates[source]:
+            if target in previous:
+                continue
+            previous[target] = source
+            if source_of[target] is None:
+                while True:
+                    source = previous[target]
+                    next_target = target_of[source]
+                    source_of[target], target_of[source] = source, target
+                    if source == start:
+                        return True
+                    target = next_target
+            queue.append(source_of[target])
+    return False
+
+
+def balanced_assignment(costs, capacities):
+    # Longest processing time first: every item, from the most expensive one, goes to the bin with the
+    # lowest load per capacity that still has room. Returns the bin of every item.
+    if sum(capacities) < len(costs):
+        raise ValueError(f"{len(costs)} items do not fit into a capacity of {sum(capacities)}.")
+
+    loads = [0.0] * len(capacities)
+    counts = [0] * len(capacities)
+    heap = [(0.0, index) for index, capacity in enumerate(capacities) if capacity > 0]
+    heapq.heapify(heap)
+
+    result = [None] * len(costs)
+    for item in sorted(range(len(costs)), key=lambda index: costs[index], reverse=True):
+        _, index = heapq.heappop(heap)
+        result[item] = index
+        loads[index] += costs[item]
+        counts[index] += 1
+        if counts[index] < capacities[index]:
+            heapq.heappush(heap, (loads[index] / capacities[index], index))
+    return result
+
+
+def distribute(total, weights):
+    # Splits total into integer parts proportional to weights, the remainder goes to the largest fractions
+    weight_sum = sum(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    parts = [int(value) for value in exact]
+    by_fraction = sorted(range(len(weights)), key=lambda index: exact[index] - parts[index], reverse=True)
+    for index in by_fraction[:total - sum(parts)]:
+        parts[index] += 1
+    return parts
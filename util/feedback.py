@@ -1,84 +1,193 @@
 import os
 import re
+from functools import lru_cache
 from json import dump as j_dump, load
 
 from data.storage import ensure_folder_exists, InteractiveDataStorage
-from util.console import string_table, align_vertical
+from util.console import string_table
+
+_CREDIT_PATTERN = re.compile(r'\[@(?P<credit>[-+]?\d+(\.\d+)?)\]')
+
+
+class FeedbackFormatError(ValueError):
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+# Task headers look like "<task prefix><task number>    [Max: <max credits>]", where the task number may have a
+# subtask letter (3a) and the max credits are integers or decimals. Templates and the polisher share this grammar.
+def task_header_line(task_name, max_credits):
+    max_credits = f'[Max: {max_credits}]'
+    return f'{task_name:<100}'[:-len(max_credits)] + max_credits
+
+
+@lru_cache(maxsize=None)
+def _task_pattern(task_prefix):
+    return re.compile(re.escape(task_prefix) + r'\s*(?P<task_number>\d+)(?P<subtask>[a-z]?)\s+\[Max:\s*(?P<max_credit>\d+(?:[.,]\d+)?)\]\s*$')
+
+
+def parse_task_header(line, task_prefix):
+    matcher = _task_pattern(task_prefix).match(line)
+    if matcher is None:
+        return None
+    task_number = f'{int(matcher.group("task_number"))}{matcher.group("subtask")}'
+    return task_number, float(matcher.group("max_credit").replace(",", "."))
+
+
+def expected_tasks(exercise_meta, task_prefix):
+    tasks = dict()
+    for task_name, max_credits in exercise_meta.max_credits:
+        parsed = parse_task_header(task_header_line(task_name, max_credits), task_prefix)
+        if parsed is not None:
+            tasks[parsed[0]] = parsed[1]
+    return tasks
+
+
+class FeedbackTemplate:
+    def __init__(self, storage: InteractiveDataStorage, exercise_number):
+        feedback_config = storage.muesli_data.feedback
+        template_data = storage.load_exercise_meta(exercise_number)
+
+        self._file_name = f'{feedback_config.file_name}.txt'
+        self._show_problems = feedback_config.show_problems
+
+        # Everything except the part about the hand in is the same for all groups
+        self._header = "\n".join([
+            '┌' + '─' * 98 + '┐',
+            f'│{template_data.title:^98}│',
+            '└' + '─' * 98 + '┘',
+        ])
+        tasks = list()
+        for task_name, max_credits in template_data.max_credits:
+            tasks.append(task_header_line(task_name, max_credits))
+            tasks.append('─' * 100)
+            tasks.append(feedback_config.default_answer)
+            tasks.append("")
+            tasks.append("")
+        self._tasks = "\n".join(tasks)
+
+    def render(self, submission_data):
+        lines = list()
+        lines.append(self._header)
+        lines.append(f'Handed in as: {submission_data["original_name"]}')
+        lines.append('')
+
+        if self._show_problems:
+            if len(submission_data["problems"]) > 0:
+                lines.append("The following issues occured with the name of the file:")
+                for problem in submission_data["problems"]:
+                    lines.append("  ■ " + problem)
+                lines.append("Please make sure to correct the issues for the next sheet.")
+                lines.append("")
+            else:
+                lines.append("Great, thanks for naming the file correctly.")
+                lines.append("")
+
+        lines.append(self._tasks)
+        return "\n".join(lines) + "\n"
+
+    def write_all(self, submissions, printer):
+        written = 0
+        for target_path, submission_data in submissions:
+            feedback_path = os.path.join(target_path, self._file_name)
+
+            if os.path.exists(feedback_path):
+                printer.warning(f"There is already a generated feedback file at {target_path}."
+                                f" Please remove it manually, if you want to recreate it.")
+            else:
+                with open(feedback_path, 'w', encoding='utf-8') as fp:
+                    fp.write(self.render(submission_data))
+                written += 1
+
+        return written
 
 
 class FeedbackPolisher:
-    def __init__(self, storage: InteractiveDataStorage, path, printer):
+    def __init__(self, storage: InteractiveDataStorage, path, printer, exercise_meta=None):
         self.printer = printer
         self._storage = storage
         self._task_prefix = storage.muesli_data.feedback.task_prefix
+        self._expected_tasks = None if exercise_meta is None else expected_tasks(exercise_meta, self._task_prefix)
         self._file_name = f"{self._storage.muesli_data.feedback.file_name}.txt"
         self._path = os.path.join(path, self._file_name)
 
         with open(os.path.join(path, "submission_meta.json"), "r") as file:
             self._data = load(file)
         self._students = self._find_students()
-        self._segments = self._read_segments()
+        self._intro, self._segments = self._read_segments()
 
-        self._analyze_credit_annotations()
         self._generate_salutation()
 
         table, self._credits_per_task = self._generate_table()
         self._feedback = self._polish_feedback(table)
 
     def _read_segments(self):
+        # One pass over the file: split it into tasks, sum up the credit annotations of each task and
+        # collect everything that cannot be parsed, so that wrong credits are never uploaded
+        problems = list()
+        intro = list()
         segments = dict()
+        segment = None
         with open(self._path, 'r', encoding='utf-8') as fp:
-            task_pattern = re.compile(self._task_prefix + r'(?P<task_number>\d)\s+\[Max: (?P<max_credit>\d+\.\d+)\]')
-            buffer = list()
-            group_type = "__intro__"
-            for line in fp:
+            for line_number, line in enumerate(fp, start=1):
                 line = line.rstrip("\n\r")
-                matcher = task_pattern.match(line)
-                if matcher:
-                    task_number = int(matcher.group("task_number"))
-                    max_credits = float(matcher.group("max_credit"))
-                    if group_type == "__intro__":
-                        segments[group_type] = {"lines": list(buffer)}
-                    else:
-                        segments[group_type]["lines"] = list(buffer)
-                    group_type = task_number
-                    segments[group_type] = {"task_number": task_number, "max_credits": max_credits}
-                    buffer = list()
-                buffer.append(line)
-            segments[group_type]["lines"] = list(buffer)
-
-        return segments
-
-    def _analyze_credit_annotations(self):
-        credit_pattern = re.compile(r'\[@(?P<credit>([-+])?\d+(\.\d+)?)\]')
-
-        for group_type, group in self._segments.items():
-            if group_type != "__intro__":
-                max_credits = group["max_credits"]
-                achieved_credits = max_credits
-                for line in group["lines"]:
-                    for entry in re.findall(credit_pattern, line):
-                        credit = float(entry[0])
-                        achieved_credits += credit
-                group["achieved_credits"] = (achieved_credits if achieved_credits >= 0.0 else 0.0)
-
-                task_name = f'{self._task_prefix} {group["task_number"]}'
-                stats = f'[{achieved_credits} / {max_credits}]'
-                line = f'{task_name:<100}'[:-len(stats)] + stats
-                group["lines"][0] = line
+                task_header = parse_task_header(line, self._task_prefix)
+                if task_header is not None:
+                    task_number, max_credits = task_header
+                    if task_number in segments:
+                        problems.append(f"Line {line_number}: task {task_number} appears twice")
+                    segment = {"task_number": task_number, "max_credits": max_credits, "achieved_credits": max_credits, "lines": list()}
+                    segments[task_number] = segment
+                elif line.startswith(self._task_prefix.strip()) and "[Max" in line:
+                    problems.append(f"Line {line_number}: could not parse task header '{line.strip()}'")
+
+                if segment is None:
+                    intro.append(line)
+                else:
+                    annotation_count = 0
+                    for matcher in _CREDIT_PATTERN.finditer(line):
+                        segment["achieved_credits"] += float(matcher.group("credit"))
+                        annotation_count += 1
+                    if line.count("[@") != annotation_count:
+                        problems.append(f"Line {line_number}: could not parse credit annotation in '{line.strip()}'")
+                    segment["lines"].append(line)
+
+        if len(segments) == 0:
+            problems.append(f"No task header like '{self._task_prefix}1 [Max: 1.0]' found in {self._file_name}")
+        elif self._expected_tasks is not None:
+            for task_number in self._expected_tasks:
+                if task_number not in segments:
+                    problems.append(f"Task {task_number} is missing")
+            for task_number, segment in segments.items():
+                if task_number not in self._expected_tasks:
+                    problems.append(f"Task {task_number} is not part of the exercise")
+                elif segment["max_credits"] != self._expected_tasks[task_number]:
+                    problems.append(f"Task {task_number} has {segment['max_credits']} max credits instead of {self._expected_tasks[task_number]}")
+
+        if len(problems) > 0:
+            raise FeedbackFormatError(problems)
+
+        for segment in segments.values():
+            achieved_credits = segment["achieved_credits"]
+            task_name = f'{self._task_prefix} {segment["task_number"]}'
+            stats = f'[{achieved_credits} / {segment["max_credits"]}]'
+            segment["lines"][0] = f'{task_name:<100}'[:-len(stats)] + stats
+            segment["achieved_credits"] = (achieved_credits if achieved_credits >= 0.0 else 0.0)
+
+        return intro, segments
 
     def _generate_table(self):
         header, data = list(), list()
         max_total, achieved_total = 0, 0
-        for group_type, group in self._segments.items():
-            if group_type != "__intro__":
-                max_credits = group["max_credits"]
-                achieved_credits = group["achieved_credits"]
+        for group in self._segments.values():
+            max_credits = group["max_credits"]
+            achieved_credits = group["achieved_credits"]
 
-                header.append(f"{self._task_prefix[0]} {group['task_number']} ({max_credits})")
-                data.append((achieved_credits,))
-                max_total += max_credits
-                achieved_total += achieved_credits
+            header.append(f"{self._task_prefix[0]} {group['task_number']} ({max_credits})")
+            data.append((achieved_credits,))
+            max_total += max_credits
+            achieved_total += achieved_credits
 
         credits_per_task = [credit for column in data for credit in column]
         header.append(f'∑ ({max_total})')
@@ -102,13 +211,6 @@ class FeedbackPolisher:
     def _polish_feedback(self, table):
         table = ["\n"] + table + ["\n"]
 
-        feedback = self._segments["__intro__"]["lines"]
-        feedback = align_vertical(feedback, self._salutation, alignment='^')
-        feedback = align_vertical(feedback, table, alignment='^')
-        for group_type, group in self._segments.items():
-            if group_type != "__intro__":
-                feedback = align_vertical(feedback, group["lines"])
-
         footer = list()
         footer.append("\n")
         footer.append('═' * 100)
@@ -116,11 +218,28 @@ class FeedbackPolisher:
         footer.append(f"Please ask questions about the feedback to ({self._storage.muesli_account.email})")
         footer.append(f"or on Discord via the private chat.")
 
-        feedback = align_vertical(feedback, footer)
+        # Same layout as stacking the parts with align_vertical: intro and salutation are centered on their own,
+        # then centered together with the table; everything is finally left aligned to the widest line.
+        head = self._intro + self._salutation
+        head_width = max(len(line) for line in head)
+        table_width = max(head_width, max(len(line) for line in table))
+        body = [line for group in self._segments.values() for line in group["lines"]]
+        width = max(table_width, max(len(line) for line in body), max(len(line) for line in footer))
+
+        feedback = list()
+        feedback.extend(format(format(line, f'^{head_width}'), f'^{table_width}') for line in head)
+        feedback.extend(f'{line:^{table_width}}' for line in table)
+        feedback = [f'{line:<{width}}' for line in feedback]
+        feedback.extend(f'{line:<{width}}' for line in body)
+        feedback.extend(f'{line:<{width}}' for line in footer)
 
         return feedback
 
-    def save_meta_to_folder(self, directory):
+    @property
+    def credits_per_task(self):
+        return list(self._credits_per_task)
+
+    def save_meta_to_folder(self, directory, source_fingerprint=None):
         ensure_folder_exists(directory)
         meta_data = dict()
         meta_data["credits_per_task"] = self._credits_per_task
@@ -128,11 +247,14 @@ class FeedbackPolisher:
         meta_data["muesli_ids"] = [student.muesli_student_id for student in self._students]
         meta_data["muesli_mails"] = [student.muesli_mail for student in self._students]
         meta_data["original_name"] = self._data["original_name"]
+        if source_fingerprint is not None:
+            meta_data["source_fingerprint"] = source_fingerprint
 
-        with open(os.path.join(directory, "meta.json"), 'w', encoding="utf-8") as fp:
-            j_dump(meta_data, fp, indent=4)
-
+        # meta.json comes last, its source fingerprint marks the folder as complete
         feedback_path = os.path.join(directory, self._file_name)
         with open(feedback_path, 'w', encoding="utf-8") as fp:
             for line in self._feedback:
                 print(line, file=fp)
+
+        with open(os.path.join(directory, "meta.json"), 'w', encoding="utf-8") as fp:
+            j_dump(meta_data, fp, indent=4)
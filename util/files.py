@@ -1,55 +1,259 @@
+import errno
+import hashlib
+import json
 import os
 import shutil
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Callable
+from zipfile import ZIP_STORED, ZipFile
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-def filter_and(*filters):
-    def and_test(path: Path):
-        return all(filter(path) for filter in filters)
+COPY_MODES = ("copy", "reflink", "hardlink")
+COPY_WORKERS = 8
 
-    return and_test
+# Deflating these again costs time and saves next to nothing
+COMPRESSED_SUFFIXES = frozenset((
+    ".zip", ".7z", ".rar", ".gz", ".tgz", ".bz2", ".xz",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp",
+    ".pdf", ".mp3", ".mp4", ".docx", ".xlsx", ".pptx", ".odt"
+))
 
+# ioctl request number of FICLONE (linux/fs.h), shares all blocks of the source with the target
+_FICLONE = 0x40049409
+_REFLINK_UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+_devices_without_reflink = set()
 
-def filter_or(*filters):
-    def and_test(path: Path):
-        return any(filter(path) for filter in filters)
 
-    return and_test
+# Filters are evaluated on the file name without extension, which copy_files computes only once per file.
+# They can still be called with a path like plain functions.
+class FileFilter(ABC):
+    @abstractmethod
+    def test(self, path, stem):
+        pass
 
+    def __call__(self, path: Path):
+        return self.test(path, os.path.splitext(os.path.basename(path))[0])
 
-def filter_not(filter):
-    def and_test(path: Path):
-        return not filter(path)
 
-    return and_test
+class _FunctionFilter(FileFilter):
+    def __init__(self, function: Callable[[Path], bool]):
+        self._function = function
 
+    def test(self, path, stem):
+        return self._function(Path(path))
+
+
+class _NameEndFilter(FileFilter):
+    def __init__(self, name_ends):
+        self.name_ends = tuple(name_ends)
+
+    def test(self, path, stem):
+        return stem.endswith(self.name_ends)
+
+
+class _AndFilter(FileFilter):
+    def __init__(self, filters):
+        self._filters = filters
+
+    def test(self, path, stem):
+        return all(filter.test(path, stem) for filter in self._filters)
+
+
+class _OrFilter(FileFilter):
+    def __init__(self, filters):
+        self._filters = filters
+
+    def test(self, path, stem):
+        return any(filter.test(path, stem) for filter in self._filters)
+
+
+class _NotFilter(FileFilter):
+    def __init__(self, filter):
+        self._filter = filter
+
+    def test(self, path, stem):
+        return not self._filter.test(path, stem)
+
+
+def compile_filter(filter) -> FileFilter:
+    if filter is None or isinstance(filter, FileFilter):
+        return filter
+    return _FunctionFilter(filter)
+
+
+def filter_and(*filters):
+    return _AndFilter([compile_filter(filter) for filter in filters])
+
+
+def filter_or(*filters):
+    filters = [compile_filter(filter) for filter in filters]
+    if all(type(filter) is _NameEndFilter for filter in filters):
+        # A single str.endswith call with all suffixes
+        return _NameEndFilter(name_end for filter in filters for name_end in filter.name_ends)
+    return _OrFilter(filters)
+
+
+def filter_not(filter):
+    return _NotFilter(compile_filter(filter))
 
-def filter_name_end(name_end: str):
-    def ends_with(path: Path):
-        return os.path.splitext(path)[0].endswith(name_end)
 
-    return ends_with
+def filter_name_end(name_end: str):
+    return _NameEndFilter((name_end,))
 
 
 def filter_name_not_end(name_end: str):
-    def ends_with(path: Path):
-        return not os.path.splitext(path)[0].endswith(name_end)
+    return _NotFilter(_NameEndFilter((name_end,)))
+
+
+def copy_file(source, target, mode="copy"):
+    # copy:     independent copy of the file
+    # reflink:  copy-on-write clone where the file system supports it (btrfs, xfs, ...), a copy otherwise
+    # hardlink: target is the same file as the source, falls back to reflink e.g. across devices
+    if mode not in COPY_MODES:
+        raise ValueError(f"Unknown copy mode '{mode}', expected one of {', '.join(COPY_MODES)}.")
+
+    if os.path.isdir(target):
+        target = os.path.join(target, os.path.basename(source))
+
+    if mode == "hardlink" and _hardlink(source, target):
+        return target
+    if mode != "copy" and _reflink(source, target):
+        return target
+
+    if os.path.lexists(target) and os.path.samefile(source, target):
+        # A hardlink from an earlier run, copy2 refuses to copy a file onto itself
+        os.unlink(target)
+    shutil.copy2(source, target)
+    return target
+
+
+def copy_function(mode):
+    def copy(source, target):
+        return copy_file(source, target, mode)
+
+    return copy
+
+
+def _hardlink(source, target):
+    try:
+        if os.path.lexists(target):
+            os.unlink(target)
+        os.link(source, target)
+        return True
+    except OSError as e:
+        if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP):
+            return False
+        raise
+
+
+def _reflink(source, target):
+    if fcntl is None:
+        return False
+
+    device = os.stat(os.path.dirname(os.path.abspath(target))).st_dev
+    if device in _devices_without_reflink:
+        return False
 
-    return ends_with
+    # Opening an existing target truncates it, which would empty the source if the target is a hardlink to it
+    if os.path.lexists(target):
+        os.unlink(target)
 
+    try:
+        with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+            fcntl.ioctl(target_file.fileno(), _FICLONE, source_file.fileno())
+    except OSError as e:
+        if e.errno in _REFLINK_UNSUPPORTED_ERRNOS:
+            _devices_without_reflink.add(device)
+            return False
+        raise
 
-def copy_files(from_path: Path, to_path: Path, filter: Callable[[Path], bool] = None):
-    for entry in from_path.iterdir():
-        target_entry = to_path / entry.name
-        if entry.name.startswith(".") or entry.name == "__MACOSX":
+    shutil.copystat(source, target)
+    return True
+
+
+def copy_files(from_path: Path, to_path: Path, filter: Callable[[Path], bool] = None, mode="copy", max_workers=COPY_WORKERS):
+    filter = compile_filter(filter)
+
+    # Walk once and collect the files to copy, directories are only created for surviving files
+    jobs = list()
+    created_directories = set()
+    pending_directories = [(str(from_path), str(to_path))]
+    while len(pending_directories) > 0:
+        source_directory, target_directory = pending_directories.pop()
+        with os.scandir(source_directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or entry.name == "__MACOSX":
+                    continue
+                elif entry.is_dir():
+                    pending_directories.append((entry.path, os.path.join(target_directory, entry.name)))
+                elif filter is None or filter.test(entry.path, os.path.splitext(entry.name)[0]):
+                    if target_directory not in created_directories:
+                        os.makedirs(target_directory, exist_ok=True)
+                        created_directories.add(target_directory)
+                    jobs.append((entry.path, os.path.join(target_directory, entry.name)))
+
+    if len(jobs) < 2 or max_workers < 2:
+        for source, target in jobs:
+            copy_file(source, target, mode)
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+            # Consume the results so that errors of single copies are raised
+            list(executor.map(lambda job: copy_file(job[0], job[1], mode), jobs))
+
+    return len(jobs)
+
+
+def data_fingerprint(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def directory_fingerprint(path):
+    listing = list()
+    pending_directories = [str(path)]
+    while len(pending_directories) > 0:
+        directory = pending_directories.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    pending_directories.append(entry.path)
+                else:
+                    stat = entry.stat()
+                    listing.append((os.path.relpath(entry.path, path), stat.st_size, stat.st_mtime_ns))
+    return data_fingerprint(sorted(listing))
+
+
+def zip_entries(directory, relative_to):
+    # (path, name in the archive) of all files below directory, the names are relative to relative_to
+    entries = list()
+    pending_directories = [str(directory)]
+    while len(pending_directories) > 0:
+        current_directory = pending_directories.pop()
+        if not os.path.isdir(current_directory):
             continue
-        elif entry.is_dir():
-            if not target_entry.is_dir():
-                target_entry.mkdir()
-            copy_files(entry, target_entry, filter)
-            if len(list(target_entry.iterdir())) == 0:
-                target_entry.rmdir()
-        else:
-            if filter is None or filter(entry):
-                shutil.copy(entry, target_entry)
+        with os.scandir(current_directory) as directory_entries:
+            for entry in directory_entries:
+                if entry.is_dir():
+                    pending_directories.append(entry.path)
+                else:
+                    entries.append((entry.path, os.path.relpath(entry.path, relative_to)))
+    entries.sort(key=lambda entry: entry[1])
+    return entries
+
+
+def write_zip(target, entries, compression=ZIP_STORED):
+    # entries: (source path, name in the archive), the archive is only moved to target when it is complete.
+    # Files are stored as they are by default, with ZIP_DEFLATED already compressed files are still only stored.
+    partial_target = f"{target}.partial"
+    with ZipFile(partial_target, 'w', compression) as zip_file:
+        for source, arcname in entries:
+            file_compression = compression
+            if compression != ZIP_STORED and os.path.splitext(source)[1].lower() in COMPRESSED_SUFFIXES:
+                file_compression = ZIP_STORED
+            zip_file.write(source, arcname, compress_type=file_compression)
+    os.replace(partial_target, target)
@@ -0,0 +1,84 @@
+import json
+import os
+from pathlib import Path
+
+
+class JsonJournal:
+    def __init__(self, path):
+        self._path = Path(path)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def exists(self):
+        return self._path.is_file()
+
+    def _records(self):
+        if not self.exists:
+            return
+        with open(self._path, 'r', encoding='utf-8') as fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be incomplete if the session was killed while writing
+                    return
+
+    def replay(self, data=None):
+        # A reset drops everything before it, including the data that was passed in
+        data = dict() if data is None else data
+        for record in self._records():
+            if record.get("reset", False):
+                data.clear()
+            elif record["value"] is None:
+                data.pop(record["key"], None)
+            else:
+                data[record["key"]] = record["value"]
+
+        return data
+
+    def __len__(self):
+        # Number of records since the last reset
+        count = 0
+        for record in self._records():
+            count = 0 if record.get("reset", False) else count + 1
+        return count
+
+    def append(self, key, value):
+        self.extend([(key, value)])
+
+    def append_removal(self, key):
+        self.extend([(key, None)])
+
+    def append_reset(self):
+        self._write([{"reset": True}])
+
+    def extend(self, items):
+        self._write([{"key": key, "value": value} for key, value in items])
+
+    def _write(self, records):
+        if len(records) == 0:
+            return
+
+        self._truncate_torn_line()
+        with open(self._path, 'a', encoding='utf-8') as fp:
+            for record in records:
+                fp.write(json.dumps(record) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def _truncate_torn_line(self):
+        # A session killed while writing may leave an incomplete last line, replay would stop there and
+        # never reach the records appended after it
+        if not self.exists:
+            return
+        content = self._path.read_bytes()
+        if len(content) > 0 and not content.endswith(b"\n"):
+            with open(self._path, 'r+b') as fp:
+                fp.truncate(content.rfind(b"\n") + 1)
+
+    def remove(self):
+        if self.exists:
+            self._path.unlink()
@@ -1,7 +1,9 @@
+import os
 import re
+from collections import defaultdict
 
 from assistance.command.info import select_student_by_name
-from data.storage import InteractiveDataStorage, replace_special_chars
+from data.storage import InteractiveDataStorage, StudentNameIndex, replace_special_chars
 from util.console import single_choice, ConsoleFormatter
 
 
@@ -21,6 +23,17 @@ def normalized_name(students):
     return ", ".join(sorted(student.muesli_name for student in students))
 
 
+def correctly_named_file(students):
+    return ", ".join(sorted(replace_special_chars(student.muesli_name) for student in students))
+
+
+def split_archive_name(file):
+    if file.endswith(".tar.gz"):
+        extension = ".tar.gz"
+        return file[:-len(extension)], extension
+    return os.path.splitext(file)
+
+
 class FileNameParser:
     def __init__(self, printer: ConsoleFormatter, storage: InteractiveDataStorage, file_name: str, exercise_number: str):
         self._printer = printer
@@ -39,20 +52,26 @@ class FileNameParser:
             name_part = self._strip_suffix()
             self._identify_students(name_part)
         except NameParsingFailed as npf:
-            if len(str(npf)) > 0:
-                self.problems.append(str(npf))
-            self._printer.warning(str(npf))
-            while True:
-                try:
-                    self._manual_all_students()
+            self._manual_fallback(npf)
+
+        self._finish_problems()
+
+    def _manual_fallback(self, npf):
+        if len(str(npf)) > 0:
+            self.problems.append(str(npf))
+        self._printer.warning(str(npf))
+        while True:
+            try:
+                self._manual_all_students()
+                break
+            except NameParsingFailed as npf_2:
+                if len(str(npf_2)) > 0:
+                    self.problems.append(str(npf_2))
+                self._printer.warning(str(npf_2))
+                if self._printer.yes_no("Do you want to skip this hand in?", default="n"):
                     break
-                except NameParsingFailed as npf_2:
-                    if len(str(npf_2)) > 0:
-                        self.problems.append(str(npf_2))
-                    self._printer.warning(str(npf_2))
-                    if self._printer.yes_no("Do you want to skip this hand in?", default="n"):
-                        break
 
+    def _finish_problems(self):
         if len(self.problems) > 0:
             self.problems.append(f"Please make sure that your MaMpf names read: {self.correctly_named_file}")
         if len(self.students) < 2:
@@ -82,34 +101,45 @@ class FileNameParser:
 
     @property
     def correctly_named_file(self):
-        return ", ".join(sorted(replace_special_chars(student.muesli_name) for student in self.students))
+        return correctly_named_file(self.students)
 
     def _strip_suffix(self):
+        if "-2" not in self._file_name:
+            raise NameParsingFailed(f"Could not find the upload date in '{self._file_name}'.")
         return self._file_name[:self._file_name.index("-2")]
 
-    def _identify_students(self, name_part):
-        self._printer.inform(f"Finding students in '{self._file_name}'.")
-
+    @staticmethod
+    def _split_student_names(name_part):
         student_names = []
         for student_name in name_part.split("__"):
             student_name = student_name.replace("_", " ")
             if len(student_name) > 0:
                 student_names.append(student_name)
+        return student_names
 
-        for student_name in student_names:
-            if any(char.isdigit() for char in student_name):
-                if self.ask_retry(f"Is '{student_name}' really a student name? (y/n)?", f"'{student_name}' could not be interpreted as a student name.") != 'y':
-                    self._printer.inform("Skip")
-                    continue
-
-            # Try to find student
-            student = select_student_by_name(student_name, self._storage, self._printer, mode='all')
-            if student is None:
-                student = self._manual_single_student(student_name)
-                if student is None:
-                    self._printer.error("Manual correction failed! Ignoring student.")
-            if student is not None:
-                self.students.append(student)
+    def _identify_students(self, name_part):
+        self._printer.inform(f"Finding students in '{self._file_name}'.")
+
+        for student_name in self._split_student_names(name_part):
+            self._identify_student(student_name)
+
+    def _identify_student(self, student_name):
+        if any(char.isdigit() for char in student_name):
+            if self.ask_retry(f"Is '{student_name}' really a student name? (y/n)?", f"'{student_name}' could not be interpreted as a student name.") != 'y':
+                self._printer.inform("Skip")
+                return
+
+        # Try to find student
+        student = select_student_by_name(student_name, self._storage, self._printer, mode='all')
+        if student is None:
+            student = self._manual_single_student(student_name)
+        self._add_student(student)
+
+    def _add_student(self, student):
+        if student is None:
+            self._printer.error("Manual correction failed! Ignoring student.")
+        else:
+            self.students.append(student)
 
     def _manual_single_student(self, student_name):
         problem = f"Could not identify student '{student_name}', manual correction needed."
@@ -170,3 +200,128 @@ class FileNameParser:
                     return None
                 else:
                     return possible_students[index]
+
+
+# Parses without asking: names that do not match exactly one student are queued in
+# `unresolved` and can be fixed interactively later on with `resolve`.
+class AutomaticFileNameParser(FileNameParser):
+    def __init__(self, printer: ConsoleFormatter, storage: InteractiveDataStorage, file_name: str, exercise_number: str, index: StudentNameIndex):
+        self._index = index
+        self.unresolved = []
+        self.failure = None
+        super().__init__(printer, storage, file_name, exercise_number)
+
+    @property
+    def resolved(self):
+        return self.failure is None and len(self.unresolved) == 0
+
+    def _parse(self):
+        try:
+            name_part = self._strip_suffix()
+        except NameParsingFailed as npf:
+            self.failure = npf
+            return
+
+        for student_name in self._split_student_names(name_part):
+            if any(char.isdigit() for char in student_name):
+                candidates = []
+            else:
+                candidates = self._index.find(student_name)
+
+            if len(candidates) == 1:
+                self.students.append(candidates[0])
+            else:
+                self.unresolved.append((student_name, candidates))
+
+        if self.resolved:
+            self._finish_problems()
+
+    def resolve(self):
+        if self.resolved:
+            return
+
+        self._printer.inform(f"Resolving '{self._file_name}'.")
+        try:
+            if self.failure is not None:
+                raise self.failure
+
+            for student_name, candidates in self.unresolved:
+                if any(char.isdigit() for char in student_name):
+                    self._identify_student(student_name)
+                elif len(candidates) == 0:
+                    self._add_student(self._manual_single_student(student_name))
+                else:
+                    index = single_choice(f"Found {len(candidates)} possible choices for '{student_name}'", candidates, self._printer)
+                    if index is not None:
+                        self.students.append(candidates[index])
+                    else:
+                        self._add_student(self._manual_single_student(student_name))
+        except NameParsingFailed as npf:
+            self._manual_fallback(npf)
+
+        self.failure = None
+        self.unresolved = []
+        self._finish_problems()
+
+
+class NameAssignments:
+    def __init__(self, names: dict, files):
+        self._names = names
+        self._files = set()
+        self._students_of_file = dict()
+        self._files_of_student = defaultdict(set)
+        self._double_assigned = set()
+
+        self.update_files(files)
+        for file, entry in names.items():
+            self._add_to_index(file, entry)
+
+    def update_files(self, files):
+        self._files = set(files)
+
+    @property
+    def removed_files(self):
+        return sorted(self._names.keys() - self._files)
+
+    @property
+    def unparsed_files(self):
+        return sorted(self._files - self._names.keys())
+
+    @property
+    def people_double_assigned(self):
+        return [(muesli_id, sorted(self._files_of_student[muesli_id])) for muesli_id in sorted(self._double_assigned)]
+
+    def errors(self):
+        return self.removed_files, self.people_double_assigned, self.unparsed_files
+
+    def set_entry(self, file, entry):
+        self._remove_from_index(file)
+        self._names[file] = entry
+        self._add_to_index(file, entry)
+
+    def remove_entry(self, file):
+        self._remove_from_index(file)
+        del self._names[file]
+
+    def remove_student(self, file, muesli_id):
+        self._names[file]["muesli_student_ids"].remove(muesli_id)
+        self._remove_from_index(file)
+        self._add_to_index(file, self._names[file])
+
+    def _add_to_index(self, file, entry):
+        muesli_ids = set(entry["muesli_student_ids"])
+        self._students_of_file[file] = muesli_ids
+        for muesli_id in muesli_ids:
+            files = self._files_of_student[muesli_id]
+            files.add(file)
+            if len(files) > 1:
+                self._double_assigned.add(muesli_id)
+
+    def _remove_from_index(self, file):
+        for muesli_id in self._students_of_file.pop(file, ()):
+            files = self._files_of_student[muesli_id]
+            files.discard(file)
+            if len(files) < 2:
+                self._double_assigned.discard(muesli_id)
+            if len(files) == 0:
+                del self._files_of_student[muesli_id]